@@ -2,16 +2,53 @@ import spotipy
 from spotipy.oauth2 import SpotifyOAuth, SpotifyClientCredentials
 from spotipy.exceptions import SpotifyOauthError, SpotifyException
 from yt_dlp import YoutubeDL
+from yt_dlp.utils import DownloadError, PostProcessingError
+from yt_dlp.postprocessor import FFmpegExtractAudioPP, get_postprocessor
+import requests
 import time
 import json
 import os
+import random
 import re
+import sys
+import unicodedata
 import shutil
+import subprocess
+import sqlite3
+import http.cookiejar
 import argparse
+import atexit
+import threading
+import multiprocessing
+import difflib
+from contextlib import nullcontext
+from functools import lru_cache, partial, wraps
+from itertools import islice, zip_longest
+from urllib.parse import urlsplit, parse_qs
 from pathlib import Path
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
 from dotenv import load_dotenv
 
+try:
+    from ytmusicapi import YTMusic
+except ImportError:
+    YTMusic = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    from tqdm import tqdm
+except ImportError:
+    tqdm = None
+
+try:
+    from rapidfuzz import fuzz
+except ImportError:
+    fuzz = None
+
 
 def env_bool(name, default=False):
     value = os.getenv(name)
@@ -51,18 +88,43 @@ SPOTIFY_CACHE_PATH = os.getenv('SPOTIFY_CACHE_PATH', '.spotify_cache')
 DOWNLOAD_FOLDER = os.getenv('DOWNLOAD_FOLDER', 'downloaded_songs')
 AUDIO_FORMAT = os.getenv('AUDIO_FORMAT', os.getenv('YTDLP_AUDIO_FORMAT', 'opus'))  # Options: opus, m4a, mp3, flac, wav
 AUDIO_QUALITY = os.getenv('AUDIO_QUALITY', os.getenv('YTDLP_AUDIO_QUALITY', 'best'))  # Options: best, 256, 192, 160, 128
+VALID_AUDIO_FORMATS = frozenset({'opus', 'm4a', 'mp3', 'flac', 'wav'})
+VALID_AUDIO_QUALITIES = frozenset({'best', '256', '192', '160', '128'})
 MAX_CONCURRENT_DOWNLOADS = int(os.getenv('MAX_CONCURRENT_DOWNLOADS', '3'))
+TRANSCODE_WORKERS = int(os.getenv('TRANSCODE_WORKERS', str(os.cpu_count() or 1)))  # concurrent ffmpeg post-processing
+SEARCH_CONCURRENCY = int(os.getenv('SEARCH_CONCURRENCY', '16'))
+DOWNLOAD_MANIFEST = os.getenv('DOWNLOAD_MANIFEST', 'downloaded.json')
+RESULTS_JSONL = 'results.jsonl'
+
+# Spotify API settings
+SPOTIFY_PAGE_WORKERS = int(os.getenv('SPOTIFY_PAGE_WORKERS', '8'))
+SPOTIFY_CONCURRENCY = int(os.getenv('SPOTIFY_CONCURRENCY', '2'))  # Spotify requests in flight at once
+
+# API rate limiting and retries
+SPOTIFY_REQUESTS_PER_SECOND = float(os.getenv('SPOTIFY_REQUESTS_PER_SECOND', '10'))
+YOUTUBE_REQUESTS_PER_SECOND = float(os.getenv('YOUTUBE_REQUESTS_PER_SECOND', '5'))
+API_MAX_RETRIES = int(os.getenv('API_MAX_RETRIES', '5'))
+
+# Spotify metadata cache (set METADATA_CACHE_PATH empty to disable)
+METADATA_CACHE_PATH = os.getenv('METADATA_CACHE_PATH', 'metadata_cache.db')
+METADATA_CACHE_TTL_LIKED = int(os.getenv('METADATA_CACHE_TTL_LIKED', str(24 * 3600)))
+METADATA_CACHE_TTL_PLAYLISTS = int(os.getenv('METADATA_CACHE_TTL_PLAYLISTS', str(24 * 3600)))
+METADATA_CACHE_TTL_PLAYLIST_TRACKS = int(os.getenv('METADATA_CACHE_TTL_PLAYLIST_TRACKS', str(7 * 24 * 3600)))
+SEARCH_CACHE_TTL = int(os.getenv('SEARCH_CACHE_TTL', str(30 * 24 * 3600)))
+SEARCH_MISS_CACHE_TTL = int(os.getenv('SEARCH_MISS_CACHE_TTL', str(24 * 3600)))  # songs no search backend matched
+SEARCH_CANDIDATES = int(os.getenv('SEARCH_CANDIDATES', '5'))
+MATCH_MIN_SCORE = float(os.getenv('MATCH_MIN_SCORE', '60'))  # 0-100; weaker candidates count as not found
 
 # yt-dlp options (can be configured with environment variables)
 YTDLP_FFMPEG_LOCATION = os.getenv('YTDLP_FFMPEG_LOCATION')
 YTDLP_OUTPUT_TEMPLATE = os.getenv('YTDLP_OUTPUT_TEMPLATE')
 YTDLP_DOWNLOAD_ARCHIVE = os.getenv('YTDLP_DOWNLOAD_ARCHIVE', 'channels_archive.txt')
+YTDLP_CACHE_DIR = os.getenv('YTDLP_CACHE_DIR')  # Unset keeps yt-dlp's persistent default (~/.cache/yt-dlp)
 YTDLP_RETRIES = int(os.getenv('YTDLP_RETRIES', '10'))
 YTDLP_FRAGMENT_RETRIES = int(os.getenv('YTDLP_FRAGMENT_RETRIES', '10'))
 YTDLP_RETRY_SLEEP = int(os.getenv('YTDLP_RETRY_SLEEP', '5'))
 YTDLP_SLEEP_INTERVAL = int(os.getenv('YTDLP_SLEEP_INTERVAL', '2'))
 YTDLP_MAX_SLEEP_INTERVAL = int(os.getenv('YTDLP_MAX_SLEEP_INTERVAL', '5'))
-YTDLP_IGNORE_ERRORS = env_bool('YTDLP_IGNORE_ERRORS', True)
 YTDLP_NO_ABORT_ON_ERROR = env_bool('YTDLP_NO_ABORT_ON_ERROR', True)
 YTDLP_CONCURRENT_FRAGMENTS = int(os.getenv('YTDLP_CONCURRENT_FRAGMENTS', '4'))
 YTDLP_JSRUNTIMES = env_list('YTDLP_JSRUNTIMES', default=[os.getenv('YTDLP_JS_RUNTIME', guess_node_runtime())])
@@ -71,6 +133,11 @@ YTDLP_CONVERT_THUMBNAILS = os.getenv('YTDLP_CONVERT_THUMBNAILS', 'png')
 YTDLP_EMBED_THUMBNAIL = env_bool('YTDLP_EMBED_THUMBNAIL', True)
 YTDLP_ADD_METADATA = env_bool('YTDLP_ADD_METADATA', True)
 YTDLP_METADATA_TEMPLATE = os.getenv('YTDLP_METADATA_TEMPLATE', '%(title)s:%(meta_title)s')
+FFMPEG_HW_ENCODERS = env_bool('FFMPEG_HW_ENCODERS', True)  # e.g. AudioToolbox AAC on macOS
+MP3_VBR = env_bool('MP3_VBR', False)  # libmp3lame -q:a 2 instead of CBR 320 when AUDIO_QUALITY=best
+# Pipe the audio stream straight from YouTube through one ffmpeg process instead of downloading, then
+# post-processing; halves disk I/O but skips thumbnail embedding and the download archive
+STREAM_TO_FFMPEG = env_bool('STREAM_TO_FFMPEG', False)
 
 # Audio format quality guide for user reference
 # opus: Best efficiency. Good quality at lower bitrates.
@@ -87,7 +154,133 @@ ZOTIFY_PASSWORD = os.getenv('ZOTIFY_PASSWORD', '')
 # Initialize clients
 sp = None
 sp_public = None
+# Playlist URLs are fetched concurrently; only one of them may create a client (and run the OAuth prompt)
+spotify_client_lock = threading.Lock()
+ytmusic_client = None
 zotify_available = False
+# "artist|title" -> file path of songs downloaded by earlier runs
+download_manifest = {}
+# Caps in-flight Spotify requests across all concurrent fetches
+spotify_request_slots = threading.Semaphore(SPOTIFY_CONCURRENCY)
+# Caps concurrent ffmpeg post-processing; held only while transcoding. create_download_executor swaps in
+# one shared by main's transcode pool and the download worker processes
+transcode_slots = threading.Semaphore(TRANSCODE_WORKERS)
+# Only request the track fields we read; keeps playlist pages small
+SPOTIFY_PLAYLIST_TRACK_FIELDS = 'total,items(track(name,uri,artists(name),album(name)))'
+
+
+class TokenBucket:
+    """Thread-safe token bucket allowing `rate` requests per second with bursts up to `capacity`"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class AdaptiveConcurrency:
+    """Concurrency limit that creeps up by one after every `window` clean completions and halves on a throttle"""
+
+    def __init__(self, limit, max_limit, window=10):
+        self.max_limit = max_limit
+        self.limit = max(1, min(limit, max_limit))
+        self.window = window
+        self.clean = 0
+
+    def record(self, throttled):
+        if throttled:
+            self.limit = max(1, self.limit // 2)
+            self.clean = 0
+            return
+        self.clean += 1
+        if self.clean >= self.window:
+            self.limit = min(self.max_limit, self.limit + 1)
+            self.clean = 0
+
+
+spotify_rate_limiter = TokenBucket(SPOTIFY_REQUESTS_PER_SECOND)
+youtube_rate_limiter = TokenBucket(YOUTUBE_REQUESTS_PER_SECOND)
+
+
+THROTTLE_MARKERS = ('429', 'too many requests')
+
+
+def is_throttle_error(error):
+    """Return True when YouTube answered with HTTP 429"""
+    return isinstance(error, DownloadError) and any(marker in str(error).lower() for marker in THROTTLE_MARKERS)
+
+
+def is_transient_error(error):
+    """Return True for rate-limit, server and network errors that are worth retrying."""
+    if isinstance(error, SpotifyException):
+        status = error.http_status or 0
+        return status == 429 or status >= 500
+    if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True
+    if isinstance(error, DownloadError):
+        message = str(error).lower()
+        return any(marker in message for marker in THROTTLE_MARKERS + ('timed out', 'http error 5', 'connection'))
+    return False
+
+
+def retry_after_seconds(error):
+    """Seconds the server asked us to wait (Retry-After header of a 429), if any"""
+    headers = getattr(error, 'headers', None) or {}
+    try:
+        return float(headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+
+def with_backoff(rate_limiter=None, max_retries=API_MAX_RETRIES, base=1.0, max_delay=30.0, slots=None):
+    """Retry transient failures with jittered exponential backoff (or the server's Retry-After),
+    pacing every attempt through rate_limiter and holding one of `slots` only while a request is in flight."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            for attempt in range(max_retries + 1):
+                if rate_limiter:
+                    rate_limiter.acquire()
+                try:
+                    with slots or nullcontext():
+                        return func(*args, **kwargs)
+                except Exception as e:
+                    if attempt == max_retries or not is_transient_error(e):
+                        raise
+                    delay = min(max_delay, base * 2 ** attempt)
+                    delay = random.uniform(delay / 2, delay)
+                    retry_after = retry_after_seconds(e)
+                    if retry_after is not None:
+                        delay = min(max_delay, max(delay, retry_after))
+                    time.sleep(delay)
+        return wrapper
+    return decorator
+
+
+@with_backoff(spotify_rate_limiter, max_delay=60.0, slots=spotify_request_slots)
+def spotify_call(func, *args, **kwargs):
+    return func(*args, **kwargs)
+
+
+@with_backoff(youtube_rate_limiter)
+def youtube_call(func, *args, **kwargs):
+    return func(*args, **kwargs)
 
 
 def is_spotify_app_premium_required_error(error):
@@ -101,6 +294,48 @@ def is_spotify_app_premium_required_error(error):
         'active premium subscription required for the owner of the app' in error_text
     )
 
+def decode_json_with_orjson(response, *args, **kwargs):
+    """requests response hook: make response.json() parse with orjson"""
+    response.json = lambda **_: orjson.loads(response.content)
+    return response
+
+def build_spotify_client(auth_manager):
+    client = spotipy.Spotify(auth_manager=auth_manager)
+    if orjson is not None:
+        # spotipy decodes every API response via response.json()
+        client._session.hooks['response'].append(decode_json_with_orjson)
+    return client
+
+def dumps_json_indented(data):
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2)
+    return json.dumps(data, indent=2, ensure_ascii=False).encode('utf-8')
+
+def write_json_file(path, data):
+    with open(path, 'wb') as f:
+        f.write(dumps_json_indented(data))
+
+def dumps_json_line(data):
+    if orjson is not None:
+        return orjson.dumps(data) + b'\n'
+    return (json.dumps(data, ensure_ascii=False) + '\n').encode('utf-8')
+
+def convert_jsonl_to_json(jsonl_path, json_path):
+    """Rewrite a JSON Lines file as an indented JSON array, one record at a time"""
+    loads = orjson.loads if orjson is not None else json.loads
+    with open(jsonl_path, 'rb') as src, open(json_path, 'wb') as dst:
+        dst.write(b'[')
+        count = 0
+        for line in src:
+            if not line.strip():
+                continue
+            # Indented JSON never has blank lines or raw newlines inside strings, so this indents every line
+            record = dumps_json_indented(loads(line)).replace(b'\n', b'\n  ')
+            dst.write(b',\n  ' if count else b'\n  ')
+            dst.write(record)
+            count += 1
+        dst.write(b'\n]' if count else b']')
+
 def check_zotify():
     global zotify_available
     try:
@@ -120,72 +355,78 @@ def check_zotify():
 def init_spotify():
     """Initialize Spotify client"""
     global sp
-    if sp is None and SPOTIFY_CLIENT_ID and SPOTIFY_CLIENT_SECRET:
-        auth_manager = SpotifyOAuth(
-            client_id=SPOTIFY_CLIENT_ID,
-            client_secret=SPOTIFY_CLIENT_SECRET,
-            redirect_uri=SPOTIFY_REDIRECT_URI,
-            scope='user-library-read playlist-read-private',
-            open_browser=False,  # Don't auto-open on headless servers
-            cache_path=SPOTIFY_CACHE_PATH
-        )
-        
-        # If no cached token, provide manual authentication
-        try:
-            token_info = auth_manager.get_cached_token()
-        except SpotifyOauthError as e:
-            error_text = str(e).lower()
-            if 'invalid_grant' in error_text or 'refresh token revoked' in error_text:
-                print("⚠️ Spotify refresh token is no longer valid. Re-authentication required.")
-                try:
-                    if os.path.exists(SPOTIFY_CACHE_PATH):
-                        os.remove(SPOTIFY_CACHE_PATH)
-                        print("✓ Removed old Spotify token cache")
-                except OSError as cache_error:
-                    print(f"  ✗ Could not remove token cache: {cache_error}")
-                token_info = None
-            else:
-                raise
-        if not token_info:
-            print("\n=== Spotify Authentication ===")
-            print("No cached token found. Starting OAuth flow...\n")
-            print(f"Using redirect URI: {SPOTIFY_REDIRECT_URI}\n")
-            
-            # Get the authorization URL
-            auth_url = auth_manager.get_authorize_url()
-            print("="*70)
-            print("STEP 1: Open this URL:\n")
-            print(f"{auth_url}\n")
-            print("="*70)
-            print("\nSTEP 2: Paste the redirect URL:")
-            print("="*70)
-            response_url = input("\nPaste URL: ").strip()
-            
+    if sp is not None:
+        return sp
+    with spotify_client_lock:
+        if sp is None and SPOTIFY_CLIENT_ID and SPOTIFY_CLIENT_SECRET:
+            auth_manager = SpotifyOAuth(
+                client_id=SPOTIFY_CLIENT_ID,
+                client_secret=SPOTIFY_CLIENT_SECRET,
+                redirect_uri=SPOTIFY_REDIRECT_URI,
+                scope='user-library-read playlist-read-private',
+                open_browser=False,  # Don't auto-open on headless servers
+                cache_path=SPOTIFY_CACHE_PATH
+            )
+
+            # If no cached token, provide manual authentication
             try:
-                # Parse the authorization code from the URL
-                code = auth_manager.parse_response_code(response_url)
-                token_info = auth_manager.get_access_token(code, as_dict=False)
-                print("\n✓ Successfully authenticated! Token saved for future use.")
-            except Exception as e:
-                print(f"\n✗ Failed: {e}")
-                raise
-        
-        sp = spotipy.Spotify(auth_manager=auth_manager)
-    return sp
+                token_info = auth_manager.get_cached_token()
+            except SpotifyOauthError as e:
+                error_text = str(e).lower()
+                if 'invalid_grant' in error_text or 'refresh token revoked' in error_text:
+                    print("⚠️ Spotify refresh token is no longer valid. Re-authentication required.")
+                    try:
+                        if os.path.exists(SPOTIFY_CACHE_PATH):
+                            os.remove(SPOTIFY_CACHE_PATH)
+                            print("✓ Removed old Spotify token cache")
+                    except OSError as cache_error:
+                        print(f"  ✗ Could not remove token cache: {cache_error}")
+                    token_info = None
+                else:
+                    raise
+            if not token_info:
+                print("\n=== Spotify Authentication ===")
+                print("No cached token found. Starting OAuth flow...\n")
+                print(f"Using redirect URI: {SPOTIFY_REDIRECT_URI}\n")
+
+                # Get the authorization URL
+                auth_url = auth_manager.get_authorize_url()
+                print("="*70)
+                print("STEP 1: Open this URL:\n")
+                print(f"{auth_url}\n")
+                print("="*70)
+                print("\nSTEP 2: Paste the redirect URL:")
+                print("="*70)
+                response_url = input("\nPaste URL: ").strip()
+
+                try:
+                    # Parse the authorization code from the URL
+                    code = auth_manager.parse_response_code(response_url)
+                    token_info = auth_manager.get_access_token(code, as_dict=False)
+                    print("\n✓ Successfully authenticated! Token saved for future use.")
+                except Exception as e:
+                    print(f"\n✗ Failed: {e}")
+                    raise
+
+            sp = build_spotify_client(auth_manager)
+        return sp
 
 def init_spotify_public():
     global sp_public
-    if sp_public is None:
-        if SPOTIFY_CLIENT_ID and SPOTIFY_CLIENT_SECRET:
-            auth_manager = SpotifyClientCredentials(
-                client_id=SPOTIFY_CLIENT_ID,
-                client_secret=SPOTIFY_CLIENT_SECRET
-            )
-            sp_public = spotipy.Spotify(auth_manager=auth_manager)
-        else:
-            print("⚠️  Spotify public URL fetching requires SPOTIFY_CLIENT_ID and SPOTIFY_CLIENT_SECRET.")
-            return None
-    return sp_public
+    if sp_public is not None:
+        return sp_public
+    with spotify_client_lock:
+        if sp_public is None:
+            if SPOTIFY_CLIENT_ID and SPOTIFY_CLIENT_SECRET:
+                auth_manager = SpotifyClientCredentials(
+                    client_id=SPOTIFY_CLIENT_ID,
+                    client_secret=SPOTIFY_CLIENT_SECRET
+                )
+                sp_public = build_spotify_client(auth_manager)
+            else:
+                print("⚠️  Spotify public URL fetching requires SPOTIFY_CLIENT_ID and SPOTIFY_CLIENT_SECRET.")
+                return None
+        return sp_public
 
 
 def ensure_dotenv_file():
@@ -291,48 +532,69 @@ def prompt_for_ytmusic_cookie():
     return cookie
 
 
-def get_ytmusic_cookie(force_refresh=False):
-    if force_refresh and os.path.exists(YTMUSIC_COOKIE_FILE):
-        try:
-            os.remove(YTMUSIC_COOKIE_FILE)
-        except OSError:
-            pass
+ytmusic_cookie = None
+# Playlist URLs are fetched concurrently; only one of them may prompt for the cookie
+ytmusic_cookie_lock = threading.Lock()
 
-    if not os.path.exists(YTMUSIC_COOKIE_FILE):
-        return prompt_for_ytmusic_cookie()
 
-    with open(YTMUSIC_COOKIE_FILE, 'r', encoding='utf-8') as f:
-        cookie = f.read().strip()
+def get_ytmusic_cookie(force_refresh=False, rejected=None):
+    """rejected is the cookie the caller saw fail; if another thread already replaced it, that one is reused"""
+    global ytmusic_cookie
+    with ytmusic_cookie_lock:
+        if force_refresh and (rejected is None or ytmusic_cookie == rejected):
+            ytmusic_cookie = None
+            if os.path.exists(YTMUSIC_COOKIE_FILE):
+                try:
+                    os.remove(YTMUSIC_COOKIE_FILE)
+                except OSError:
+                    pass
 
-    if not cookie:
-        return prompt_for_ytmusic_cookie()
+        if ytmusic_cookie:
+            return ytmusic_cookie
 
-    return cookie
+        if not os.path.exists(YTMUSIC_COOKIE_FILE):
+            ytmusic_cookie = prompt_for_ytmusic_cookie()
+            return ytmusic_cookie
+
+        with open(YTMUSIC_COOKIE_FILE, 'r', encoding='utf-8') as f:
+            cookie = f.read().strip()
+
+        ytmusic_cookie = cookie or prompt_for_ytmusic_cookie()
+        return ytmusic_cookie
 
 
-def write_ytmusic_cookiefile(cookie):
-    cookie_lines = ['# Netscape HTTP Cookie File\n']
+def ytdlp_cache_opts():
+    return {'cachedir': YTDLP_CACHE_DIR} if YTDLP_CACHE_DIR else {}
+
+
+@lru_cache(maxsize=4)
+def parse_ytmusic_cookie(cookie):
+    """Turn the raw Cookie header into cookiejar entries scoped to .youtube.com"""
+    cookies = []
     for pair in cookie.split('; '):
         if '=' in pair:
             name, value = pair.split('=', 1)
-            cookie_lines.append(f'.youtube.com\tTRUE\t/\tTRUE\t0\t{name}\t{value}\n')
-    with open('cookies.txt', 'w', encoding='utf-8') as f:
-        f.writelines(cookie_lines)
+            cookies.append(http.cookiejar.Cookie(
+                0, name, value, None, False, '.youtube.com', True, True, '/', True,
+                True, None, False, None, None, {}))
+    return tuple(cookies)
+
+
+def load_ytmusic_cookie(ydl, cookie):
+    for entry in parse_ytmusic_cookie(cookie):
+        ydl.cookiejar.set_cookie(entry)
 
 
 def extract_ytmusic_info(url):
+    cookie = None
     for attempt in range(2):
-        cookie = get_ytmusic_cookie(force_refresh=(attempt > 0))
-        write_ytmusic_cookiefile(cookie)
+        cookie = get_ytmusic_cookie(force_refresh=(attempt > 0), rejected=cookie)
         try:
-            with YoutubeDL({'quiet': True, 'no_warnings': True, 'extract_flat': True,
-                           'cookiefile': 'cookies.txt'}) as ydl:
-                return ydl.extract_info(url, download=False)
+            return get_ytmusic_ydl(cookie).extract_info(url, download=False)
         except Exception as e:
             if attempt == 0 and is_ytmusic_cookie_error(e):
                 print("\n⚠️ YouTube Music cookie appears invalid or expired.")
                 print("Please paste a fresh cookie to continue.")
-                get_ytmusic_cookie(force_refresh=True)
                 continue
             raise
 
@@ -358,29 +620,52 @@ def download_with_zotify(track_uri, track_name, artist_name, subfolder=None):
         print(f"  ✗ Zotify failed: {e}")
     return None
 
-def download_youtube_audio(url, track_name, artist_name, subfolder=None, output_template=None):
-    """Download audio from YouTube"""
-    # Determine the download path
-    if subfolder:
-        download_path = os.path.join(DOWNLOAD_FOLDER, subfolder)
-    else:
-        download_path = DOWNLOAD_FOLDER
-    
-    Path(download_path).mkdir(parents=True, exist_ok=True)
-    
-    safe_filename = "".join(c for c in f"{artist_name} - {track_name}" 
-                           if c.isalnum() or c in (' ', '-', '_')).strip()
+# ASCII code points kept in filenames: 0-9, A-Z, a-z, space, '-' and '_'
+ASCII_FILENAME_CHARS = frozenset([*range(0x30, 0x3a), *range(0x41, 0x5b), *range(0x61, 0x7b), 0x20, 0x2d, 0x5f])
+
+
+class FilenameCharTable(dict):
+    """str.translate table that keeps letters, digits, space, '-' and '_' and deletes everything else.
+
+    The ASCII range is filled in up front from its code points; other entries are filled in on first
+    sight of each code point, so the table stays small while still covering non-Latin scripts.
+    """
+
+    def __init__(self):
+        super().__init__((codepoint, codepoint if codepoint in ASCII_FILENAME_CHARS else None)
+                         for codepoint in range(128))
 
+    def __missing__(self, codepoint):
+        char = chr(codepoint)
+        self[codepoint] = codepoint if char.isalnum() or char in ' -_' else None
+        return self[codepoint]
+
+
+FILENAME_CHAR_TABLE = FilenameCharTable()
+ASCII_FILENAME_DELETE = bytes(codepoint for codepoint in range(128) if codepoint not in ASCII_FILENAME_CHARS)
+
+
+def sanitize_filename(text):
+    if text.isascii():
+        # Most titles are plain ASCII; bytes.translate deletes from a 128-byte set without any dict lookups
+        return text.encode('ascii').translate(None, ASCII_FILENAME_DELETE).decode('ascii').strip()
+    return text.translate(FILENAME_CHAR_TABLE).strip()
+
+
+def build_download_ydl_opts(cookiefile=None):
+    """Build the yt-dlp options shared by every download; per-track values are set in download_youtube_audio"""
     # Configure format selection based on user preference
+    # FFmpegExtractAudio stream-copies instead of re-encoding when the downloaded codec already
+    # matches preferredcodec, so prefer source formats that need no transcode
     if AUDIO_FORMAT == 'opus':
-        # Download best audio and prefer WebM first, then m4a, then any audio
-        format_str = 'bestaudio[ext=webm]/bestaudio[ext=m4a]/bestaudio/best'
+        # Download Opus audio first (WebM), then m4a, then any audio
+        format_str = 'bestaudio[acodec=opus]/bestaudio[ext=webm]/bestaudio[ext=m4a]/bestaudio/best'
         postprocessors = [{'key': 'FFmpegExtractAudio', 'preferredcodec': 'opus', 
                           'preferredquality': AUDIO_QUALITY if AUDIO_QUALITY != 'best' else '0'}]
     elif AUDIO_FORMAT == 'm4a':
-        # Download best m4a/aac audio, fallback to any audio
+        # Download best m4a/aac audio, fallback to any audio; 'm4a' remuxes AAC instead of writing raw ADTS
         format_str = 'bestaudio[ext=m4a]/bestaudio/best'
-        postprocessors = [{'key': 'FFmpegExtractAudio', 'preferredcodec': 'aac',
+        postprocessors = [{'key': 'FFmpegExtractAudio', 'preferredcodec': 'm4a',
                           'preferredquality': AUDIO_QUALITY if AUDIO_QUALITY != 'best' else '0'}]
     elif AUDIO_FORMAT == 'flac':
         # Lossless but source is lossy (YouTube)
@@ -392,20 +677,18 @@ def download_youtube_audio(url, track_name, artist_name, subfolder=None, output_
         postprocessors = [{'key': 'FFmpegExtractAudio', 'preferredcodec': 'wav'}]
     else:  # mp3 re-encoding
         format_str = 'bestaudio/best'
+        # yt-dlp treats qualities below 10 as VBR levels (-q:a) rather than bitrates
         postprocessors = [{'key': 'FFmpegExtractAudio', 'preferredcodec': 'mp3',
-                          'preferredquality': AUDIO_QUALITY if AUDIO_QUALITY != 'best' else '320'}]
+                          'preferredquality': AUDIO_QUALITY if AUDIO_QUALITY != 'best' else ('2' if MP3_VBR else '320')}]
 
     if YTDLP_ADD_METADATA:
         postprocessors.append({'key': 'FFmpegMetadata', 'add_metadata': True})
     if YTDLP_EMBED_THUMBNAIL:
         postprocessors.append({'key': 'EmbedThumbnail'})
-    
-    ytdlp_outtmpl = output_template or YTDLP_OUTPUT_TEMPLATE or f'{download_path}/%(uploader)s/%(title)s.%(ext)s'
 
     ydl_opts = {
         'format': format_str,
         'postprocessors': postprocessors,
-        'outtmpl': ytdlp_outtmpl,
         'writethumbnail': True,
         'quiet': True,
         'no_warnings': True,
@@ -417,7 +700,6 @@ def download_youtube_audio(url, track_name, artist_name, subfolder=None, output_
         'retry_sleep': YTDLP_RETRY_SLEEP,
         'sleep_interval': YTDLP_SLEEP_INTERVAL,
         'max_sleep_interval': YTDLP_MAX_SLEEP_INTERVAL,
-        'ignoreerrors': YTDLP_IGNORE_ERRORS,
         'abort_on_error': not YTDLP_NO_ABORT_ON_ERROR,
         'concurrent_fragments': YTDLP_CONCURRENT_FRAGMENTS,
         'jsruntimes': YTDLP_JSRUNTIMES,
@@ -431,53 +713,589 @@ def download_youtube_audio(url, track_name, artist_name, subfolder=None, output_
         'http_headers': {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0.0.0 Safari/537.36'
         },
-        'postprocessor_args': ['-metadata', f'title={track_name}', '-metadata', f'artist={artist_name}',
-                              '-metadata', f'album={subfolder if subfolder else "Downloaded"}'],
     }
-    if os.path.exists('cookies.txt'):
-        ydl_opts['cookiefile'] = 'cookies.txt'
+    ydl_opts.update(ytdlp_cache_opts())
+    if cookiefile:
+        ydl_opts['cookiefile'] = cookiefile
     if YTDLP_METADATA_TEMPLATE:
         ydl_opts['metadata'] = [YTDLP_METADATA_TEMPLATE]
+    return ydl_opts
+
+
+# Faster drop-in encoders for the codecs FFmpegExtractAudio picks (yt-dlp already prefers libfdk_aac itself)
+HW_AUDIO_ENCODERS = {'aac': 'aac_at'}
+
+
+def ffmpeg_executable():
+    ffmpeg = YTDLP_FFMPEG_LOCATION or 'ffmpeg'
+    if os.path.isdir(ffmpeg):
+        ffmpeg = os.path.join(ffmpeg, 'ffmpeg')
+    return ffmpeg
+
+@lru_cache(maxsize=None)
+def probe_ffmpeg_encoders():
+    """Names of the encoders the local ffmpeg build provides; probed once per process"""
+    try:
+        output = subprocess.check_output([ffmpeg_executable(), '-hide_banner', '-encoders'],
+                                         stderr=subprocess.DEVNULL, text=True)
+    except (OSError, subprocess.CalledProcessError):
+        return frozenset()
+    encoders = set()
+    for line in output.splitlines():
+        parts = line.split()
+        if len(parts) >= 2 and len(parts[0]) == 6 and parts[0][0] in 'VAS' and parts[1] != '=':
+            encoders.add(parts[1])
+    return frozenset(encoders)
+
+def hardware_audio_encoders():
+    if not FFMPEG_HW_ENCODERS:
+        return {}
+    available = probe_ffmpeg_encoders()
+    return {codec: encoder for codec, encoder in HW_AUDIO_ENCODERS.items() if encoder in available}
+
+
+class HardwareExtractAudioPP(FFmpegExtractAudioPP):
+    """FFmpegExtractAudio that swaps in a faster encoder when it has to transcode (stream copies are left alone)"""
+
+    def __init__(self, downloader=None, encoders=None, **kwargs):
+        super().__init__(downloader, **kwargs)
+        self.encoders = encoders or {}
+
+    def run_ffmpeg(self, path, out_path, codec, more_opts):
+        if codec in self.encoders:
+            codec = self.encoders[codec]
+            more_opts = self._quality_args(codec)
+        return super().run_ffmpeg(path, out_path, codec, more_opts)
+
+
+def build_download_ydl(cookiefile=None, postprocess=True):
+    opts = build_download_ydl_opts(cookiefile)
+    # Each instance handles one video per call, so failures must raise: ignoreerrors would turn them into
+    # a None result that youtube_call's retry/backoff never sees, or a failed transcode into a "finished" file
+    opts['ignoreerrors'] = False
+    if not postprocess:
+        # Fetch-only instance: downloads the source audio and thumbnail, leaving ffmpeg to post_process()
+        opts['postprocessors'] = []
+        ydl = YoutubeDL(opts)
+        # The archive stays preloaded so finished videos are still skipped, but nothing is recorded at
+        # fetch time; transcode_download records a video once its audio file exists
+        ydl.params['download_archive'] = None
+        return ydl
+    encoders = hardware_audio_encoders()
+    if not encoders:
+        return YoutubeDL(opts)
+    # Register the postprocessors by hand (same order) so extract-audio can use the faster encoder;
+    # ffmpeg postprocessor_args can't do this since yt-dlp's own -acodec comes after them
+    postprocessors = opts.pop('postprocessors')
+    ydl = YoutubeDL(opts)
+    for pp_def in postprocessors:
+        pp_def = dict(pp_def)
+        key = pp_def.pop('key')
+        if key == 'FFmpegExtractAudio':
+            ydl.add_post_processor(HardwareExtractAudioPP(ydl, encoders=encoders, **pp_def))
+        else:
+            ydl.add_post_processor(get_postprocessor(key)(ydl, **pp_def))
+    return ydl
+
+
+# yt-dlp instances are expensive to build (extractors, postprocessors, HTTP opener),
+# so each worker thread keeps its own and reuses it for every song
+ytdlp_instances = threading.local()
+# Every instance handed out above, so their HTTP connections can be closed at exit
+created_ytdlp_instances = []
+
+
+def track_ydl(ydl):
+    created_ytdlp_instances.append(ydl)
+    return ydl
+
+
+@atexit.register
+def close_ytdlp_instances():
+    while created_ytdlp_instances:
+        try:
+            created_ytdlp_instances.pop().close()
+        except Exception:
+            pass
+
+
+def get_search_ydl():
+    ydl = getattr(ytdlp_instances, 'search', None)
+    if ydl is None:
+        ydl = ytdlp_instances.search = track_ydl(YoutubeDL({'quiet': True, 'no_warnings': True, 'extract_flat': True,
+                                                  'default_search': f'ytsearch{SEARCH_CANDIDATES}',
+                                                  **ytdlp_cache_opts()}))
+    return ydl
+
+
+def get_download_ydl(cookiefile=None, postprocess=True):
+    downloaders = getattr(ytdlp_instances, 'downloaders', None)
+    if downloaders is None:
+        downloaders = ytdlp_instances.downloaders = {}
+    key = (cookiefile, postprocess)
+    if key not in downloaders:
+        ydl = downloaders[key] = track_ydl(build_download_ydl(cookiefile, postprocess))
+        if ytmusic_cookie:
+            load_ytmusic_cookie(ydl, ytmusic_cookie)
+    return downloaders[key]
+
+
+def get_ytmusic_ydl(cookie):
+    """Playlist/liked-songs extractor for YouTube Music, reloading the cookie jar only when the cookie changes"""
+    ydl = getattr(ytdlp_instances, 'ytmusic', None)
+    if ydl is None:
+        ydl = ytdlp_instances.ytmusic = track_ydl(YoutubeDL({'quiet': True, 'no_warnings': True, 'extract_flat': True,
+                                                             **ytdlp_cache_opts()}))
+    if getattr(ytdlp_instances, 'ytmusic_cookie', None) != cookie:
+        ydl.cookiejar.clear()
+        load_ytmusic_cookie(ydl, cookie)
+        ytdlp_instances.ytmusic_cookie = cookie
+    return ydl
+
+
+# ffmpeg encoder per AUDIO_FORMAT, and the source acodec prefix that can be stream-copied instead
+FFMPEG_AUDIO_CODECS = {'opus': ('libopus', 'opus'), 'm4a': ('aac', 'mp4a'), 'mp3': ('libmp3lame', 'mp3'),
+                       'flac': ('flac', 'flac'), 'wav': ('pcm_s16le', None)}
+
+
+def ffmpeg_audio_codec_args(source_acodec):
+    encoder, copyable = FFMPEG_AUDIO_CODECS.get(AUDIO_FORMAT, FFMPEG_AUDIO_CODECS['mp3'])
+    if copyable and (source_acodec or '').startswith(copyable):
+        return ['-c:a', 'copy']
+    encoder = hardware_audio_encoders().get(encoder, encoder)
+    args = ['-c:a', encoder]
+    if AUDIO_FORMAT in ('flac', 'wav'):
+        return args
+    if AUDIO_QUALITY != 'best':
+        return args + ['-b:a', f'{AUDIO_QUALITY}k']
+    if encoder == 'libmp3lame':
+        return args + (['-q:a', '2'] if MP3_VBR else ['-b:a', '320k'])
+    return args
+
+def stream_youtube_audio(ydl, url, metadata_args):
+    """Resolve the best audio stream URL and let a single ffmpeg process fetch, convert and tag it"""
+    info = youtube_call(ydl.extract_info, url, download=False)
+    if not info or not info.get('url'):
+        return None
+    filepath = f"{os.path.splitext(ydl.prepare_filename(info))[0]}.{AUDIO_FORMAT}"
+    Path(filepath).parent.mkdir(parents=True, exist_ok=True)
+    headers = ''.join([f"{key}: {value}\r\n" for key, value in (info.get('http_headers') or {}).items()])
+    command = [ffmpeg_executable(), '-loglevel', 'error', '-y']
+    if headers:
+        command += ['-headers', headers]
+    command += ['-i', info['url'], '-vn', *ffmpeg_audio_codec_args(info.get('acodec')),
+                '-threads', '1', *metadata_args, filepath]
+    if subprocess.run(command, stdin=subprocess.DEVNULL).returncode != 0:
+        return None
+    return filepath
+
+@lru_cache(maxsize=None)
+def user_cookiefile():
+    """cookies.txt exported by the user for downloads; looked up once per process, not once per song"""
+    return 'cookies.txt' if os.path.exists('cookies.txt') else None
+
+download_state = threading.local()
+
+
+def in_youtube_download_archive(ydl, url):
+    """extract_info returns None, not an error, for videos a previous run recorded in the download archive"""
+    video_ids = parse_qs(urlsplit(url).query).get('v')
+    return bool(video_ids) and ydl.in_download_archive({'id': video_ids[0], 'extractor_key': 'Youtube'})
+
+def download_youtube_audio(url, track_name, artist_name, subfolder=None, output_template=None):
+    """Download audio from YouTube"""
+    path, fetched = fetch_youtube_audio(url, track_name, artist_name, subfolder, output_template)
+    return transcode_download(**fetched) if fetched else path
+
+def fetch_youtube_audio(url, track_name, artist_name, subfolder=None, output_template=None):
+    """Download stage: fetch the source audio, leaving ffmpeg to transcode_download.
+
+    Returns (path, None) when there is nothing left to transcode (streamed, archived or failed with path
+    None), or (None, fetched) with transcode_download's keyword arguments for the fetched file.
+    """
+    # Determine the download path
+    if subfolder:
+        download_path = os.path.join(DOWNLOAD_FOLDER, subfolder)
+    else:
+        download_path = DOWNLOAD_FOLDER
+    
+    Path(download_path).mkdir(parents=True, exist_ok=True)
+    
+    ytdlp_outtmpl = output_template or YTDLP_OUTPUT_TEMPLATE or f'{download_path}/%(uploader)s/%(title)s.%(ext)s'
+    # Reported when yt-dlp gives back no file name, e.g. for a video it skipped as already archived
+    default_path = f"{download_path}/{sanitize_filename(f'{artist_name} - {track_name}')}.{AUDIO_FORMAT}"
     
     try:
-        with YoutubeDL(ydl_opts) as ydl:
-            ydl.download([url])
-        return f"{download_path}/{safe_filename}.{AUDIO_FORMAT}"
+        cookiefile = user_cookiefile()
+        metadata_args = ['-metadata', f'title={track_name}', '-metadata', f'artist={artist_name}',
+                         '-metadata', f'album={subfolder if subfolder else "Downloaded"}']
+        if STREAM_TO_FFMPEG:
+            ydl = get_download_ydl(cookiefile)
+            ydl.params['outtmpl']['default'] = ytdlp_outtmpl
+            filepath = stream_youtube_audio(ydl, url, metadata_args)
+            if not filepath and in_youtube_download_archive(ydl, url):
+                download_state.already_downloaded = True
+                return default_path, None
+            return filepath, None
+        fetcher = get_download_ydl(cookiefile, postprocess=False)
+        fetcher.params['outtmpl']['default'] = ytdlp_outtmpl
+        info = youtube_call(fetcher.extract_info, url, download=True)
+        if not info:
+            if in_youtube_download_archive(fetcher, url):
+                download_state.already_downloaded = True
+                return default_path, None
+            return None, None
+        downloads = info.get('requested_downloads')
+        if not downloads or not downloads[-1].get('filepath'):
+            return default_path, None
+        # Plain data only: a download worker process hands this back to main's transcode pool
+        download = {key: value for key, value in YoutubeDL.sanitize_info(downloads[-1]).items()
+                    if not key.startswith('__')}
+        return None, {'download': download, 'cookiefile': cookiefile, 'metadata_args': metadata_args}
+    except DownloadError as e:
+        # Seen by process_song, which reports it so main can lower the download concurrency
+        download_state.throttled = is_throttle_error(e)
+        return None, None
     except:
+        return None, None
+
+def transcode_download(download, cookiefile, metadata_args):
+    """Run the ffmpeg postprocessors (extract audio, metadata, thumbnail) on an already fetched file"""
+    ydl = get_download_ydl(cookiefile)
+    # Keep each transcode single-threaded; parallelism comes from transcode_slots
+    ydl.params['postprocessor_args'] = {'ffmpegextractaudio': ['-threads', '1'] + metadata_args,
+                                        'default': metadata_args}
+    # Thumbnails stay where the fetch wrote them; the thumbnail postprocessors expect them listed here
+    files_to_move = {thumbnail['filepath']: thumbnail['filepath']
+                     for thumbnail in download.get('thumbnails') or [] if thumbnail.get('filepath')}
+    with transcode_slots:
+        try:
+            processed = ydl.post_process(download['filepath'], download, files_to_move)
+        except PostProcessingError:
+            return None
+    ydl.record_download_archive(processed)
+    return processed.get('filepath')
+
+def init_ytmusic():
+    """Initialize the unauthenticated YouTube Music client used for song search"""
+    global ytmusic_client
+    if ytmusic_client is None and YTMusic is not None:
+        ytmusic_client = YTMusic()
+    return ytmusic_client
+
+def youtube_candidate(video_id, title, channel=''):
+    return {'title': title, 'url': f"https://www.youtube.com/watch?v={video_id}", 'id': video_id, 'channel': channel}
+
+def search_ytmusic_candidates(query):
+    """Top YouTube Music song results; one small JSON request instead of a yt-dlp search"""
+    client = init_ytmusic()
+    if not client:
+        return []
+    try:
+        results = youtube_call(client.search, query, filter='songs', limit=SEARCH_CANDIDATES)
+    except Exception:
+        return []
+    return [youtube_candidate(item['videoId'], item.get('title', ''),
+                              ', '.join([artist.get('name', '') for artist in item.get('artists') or []]))
+            for item in results if item.get('videoId')][:SEARCH_CANDIDATES]
+
+YOUTUBE_SEARCH_URL = 'https://www.youtube.com/youtubei/v1/search?prettyPrint=false'
+YOUTUBE_SEARCH_CLIENT = {'clientName': 'WEB', 'clientVersion': '2.20240101.00.00', 'hl': 'en'}
+YOUTUBE_SEARCH_VIDEOS_ONLY = 'EgIQAQ=='
+http_sessions = threading.local()
+
+
+def get_http_session():
+    """Per-thread requests session so repeated searches reuse keep-alive connections"""
+    session = getattr(http_sessions, 'session', None)
+    if session is None:
+        session = http_sessions.session = requests.Session()
+    return session
+
+def iter_video_renderers(node):
+    """Depth-first, document-order walk of an innertube response yielding its videoRenderers"""
+    stack = [node]
+    while stack:
+        current = stack.pop()
+        if isinstance(current, dict):
+            renderer = current.get('videoRenderer')
+            if isinstance(renderer, dict) and renderer.get('videoId'):
+                yield renderer
+                continue
+            stack.extend(reversed(list(current.values())))
+        elif isinstance(current, list):
+            stack.extend(reversed(current))
+
+def search_innertube_candidates(query):
+    """Top YouTube videos for query via one youtubei search request, without yt-dlp's extractor machinery"""
+    try:
+        response = youtube_call(get_http_session().post, YOUTUBE_SEARCH_URL, timeout=10, json={
+            'context': {'client': YOUTUBE_SEARCH_CLIENT},
+            'query': query,
+            'params': YOUTUBE_SEARCH_VIDEOS_ONLY,
+        })
+        response.raise_for_status()
+        renderers = list(islice(iter_video_renderers(response.json()), SEARCH_CANDIDATES))
+    except (requests.exceptions.RequestException, ValueError):
+        return []
+    candidates = []
+    for renderer in renderers:
+        title_runs = (renderer.get('title') or {}).get('runs') or [{}]
+        owner_runs = (renderer.get('ownerText') or {}).get('runs') or [{}]
+        candidates.append(youtube_candidate(renderer['videoId'], title_runs[0].get('text', ''),
+                                            owner_runs[0].get('text', '')))
+    return candidates
+
+def search_ytdlp_candidates(query):
+    result = youtube_call(get_search_ydl().extract_info, f"ytsearch{SEARCH_CANDIDATES}:{query}", download=False)
+    return [youtube_candidate(video['id'], video.get('title', ''), video.get('channel') or video.get('uploader') or '')
+            for video in (result or {}).get('entries') or [] if video and video.get('id')]
+
+def token_set_similarity(a, b):
+    """difflib stand-in for rapidfuzz's token_set_ratio: extra words on one side (e.g. the channel) don't count against a match"""
+    tokens_a, tokens_b = set(a.split()), set(b.split())
+    common = ' '.join(sorted(tokens_a & tokens_b))
+    with_a = ' '.join(filter(None, [common, ' '.join(sorted(tokens_a - tokens_b))]))
+    with_b = ' '.join(filter(None, [common, ' '.join(sorted(tokens_b - tokens_a))]))
+    pairs = [(with_a, with_b)] + ([(common, with_a), (common, with_b)] if common else [])
+    return 100 * max(difflib.SequenceMatcher(None, x, y).ratio() for x, y in pairs)
+
+def score_youtube_candidate(candidate, track_name, artist_name):
+    """0-100 similarity of a search result's title and channel to the wanted "artist title" """
+    wanted = normalize_song_text(f"{artist_name} {track_name}")
+    found = normalize_song_text(f"{candidate.get('channel', '')} {candidate['title']}")
+    if fuzz is not None:
+        return fuzz.token_set_ratio(found, wanted)
+    return token_set_similarity(found, wanted)
+
+def pick_best_youtube_match(candidates, track_name, artist_name):
+    """Best-scoring candidate, or None when even that one looks like a different song (cover, remix, ...)"""
+    scored = [(score_youtube_candidate(candidate, track_name, artist_name), -rank, candidate)
+              for rank, candidate in enumerate(candidates)]
+    if not scored:
         return None
+    score, _, best = max(scored, key=lambda entry: entry[:2])
+    return best if score >= MATCH_MIN_SCORE else None
+
+def youtube_search_cache_key(track_name, artist_name):
+    return f"youtube_search:{normalize_song_text(track_name)}|{normalize_song_text(artist_name)}"
+
+def youtube_search_miss_key(track_name, artist_name):
+    return f"youtube_search_miss:{normalize_song_text(track_name)}|{normalize_song_text(artist_name)}"
 
 def search_youtube_for_song(track_name, artist_name, download=False, subfolder=None, output_template=None):
     query = f"{track_name} {artist_name}"
+    cache_key = youtube_search_cache_key(track_name, artist_name)
     try:
-        with YoutubeDL({'quiet': True, 'no_warnings': True, 'extract_flat': True, 
-                       'default_search': 'ytsearch1'}) as ydl:
-            result = ydl.extract_info(f"ytsearch1:{query}", download=False)
-            if result and 'entries' in result and result['entries']:
-                video = result['entries'][0]
-                video_info = {'title': video.get('title', ''), 
-                            'url': f"https://www.youtube.com/watch?v={video['id']}", 'id': video['id']}
-                if download:
-                    video_info['download_path'] = download_youtube_audio(
-                        video_info['url'], track_name, artist_name, subfolder, output_template=output_template)
-                return video_info
+        video_info = metadata_cache_get(cache_key, SEARCH_CACHE_TTL)
+        if not video_info and metadata_cache_get(youtube_search_miss_key(track_name, artist_name), SEARCH_MISS_CACHE_TTL):
+            return None
+        if not video_info:
+            # Cheapest backend first; fall through when none of its results is a convincing match
+            for search in (search_ytmusic_candidates, search_innertube_candidates, search_ytdlp_candidates):
+                video_info = pick_best_youtube_match(search(query), track_name, artist_name)
+                if video_info:
+                    break
+            if video_info:
+                metadata_cache_put(cache_key, video_info)
+            else:
+                # Remember the miss for a shorter while, so re-runs don't search again for songs YouTube lacks
+                metadata_cache_put(youtube_search_miss_key(track_name, artist_name), True)
+        if video_info:
+            if download:
+                video_info['download_path'] = download_youtube_audio(
+                    video_info['url'], track_name, artist_name, subfolder, output_template=output_template)
+                if not video_info['download_path']:
+                    # Don't keep steering future runs to a video that fails to download
+                    metadata_cache_delete(cache_key)
+            return video_info
     except:
         pass
     return None
 
+def find_youtube_matches(songs):
+    """Search YouTube for many songs at once; searches are pure network waits, so they fan out far wider than downloads.
+
+    Songs that share a search cache key (the same normalized title and artists) are searched only once.
+    """
+    keys = [youtube_search_cache_key(song['name'], song['artist']) for song in songs]
+    queries = {}
+    for key, song in zip(keys, songs):
+        queries.setdefault(key, song)
+    with ThreadPoolExecutor(max_workers=SEARCH_CONCURRENCY) as executor:
+        matches = dict(zip(queries, executor.map(lambda song: search_youtube_for_song(song['name'], song['artist']),
+                                                 queries.values())))
+    return [matches[key] for key in keys]
+
+def ytmusic_video_match(song):
+    """YouTube Music songs already carry their video ID, so they need no search"""
+    return youtube_candidate(song['videoId'], song['name'], song['artist'])
+
+def resolve_youtube_matches(songs, download):
+    """Partition songs by how their YouTube video is found and resolve all of them before downloading.
+
+    Returns {id(song): match or None} for every song whose match is settled; the rest
+    (Zotify candidates, songs already on disk) are left to process_song.
+    """
+    ytmusic_ready = [song for song in songs if song.get('source') == 'ytmusic' and song.get('videoId')]
+    ready_ids = {id(song) for song in ytmusic_ready}
+    need_search = [song for song in songs if id(song) not in ready_ids
+                   and not (download and (zotify_available or get_downloaded_path(song)))]
+    matches = {id(song): ytmusic_video_match(song) for song in ytmusic_ready}
+    if need_search:
+        print(f"\nSearching YouTube for {len(need_search)} songs with {SEARCH_CONCURRENCY} workers...")
+        for song, match in zip(need_search, find_youtube_matches(need_search)):
+            matches[id(song)] = match
+    return matches
+
+# One pass covers both open.spotify.com/<type>/<id> links and spotify:<type>:<id> URIs
+SPOTIFY_ITEM_RE = re.compile(r'spotify\.com/(playlist|album|track)/([a-zA-Z0-9]+)'
+                             r'|spotify:(playlist|album|track):([a-zA-Z0-9]+)')
+
+
 def parse_spotify_url(url):
-    patterns = [
-        (r'spotify\.com/playlist/([a-zA-Z0-9]+)', 'playlist'),
-        (r'spotify\.com/album/([a-zA-Z0-9]+)', 'album'),
-        (r'spotify\.com/track/([a-zA-Z0-9]+)', 'track'),
-        (r'spotify:playlist:([a-zA-Z0-9]+)', 'playlist'),
-        (r'spotify:album:([a-zA-Z0-9]+)', 'album'),
-        (r'spotify:track:([a-zA-Z0-9]+)', 'track'),
-    ]
-    for pattern, url_type in patterns:
-        match = re.search(pattern, url)
-        if match:
-            return match.group(1), url_type
-    return None, None
+    match = SPOTIFY_ITEM_RE.search(url)
+    if not match:
+        return None, None
+    if match.group(1):
+        return match.group(2), match.group(1)
+    return match.group(4), match.group(3)
+
+metadata_cache_connections = threading.local()
+
+
+def open_metadata_cache():
+    """This thread's connection to the cache database, opened once and kept for every later lookup"""
+    connections = getattr(metadata_cache_connections, 'by_path', None)
+    if connections is None:
+        connections = metadata_cache_connections.by_path = {}
+    # Keyed by pid too: a forked download worker must not reuse the parent's connection
+    key = (os.getpid(), METADATA_CACHE_PATH)
+    conn = connections.get(key)
+    if conn is None:
+        conn = sqlite3.connect(METADATA_CACHE_PATH, timeout=10)
+        # WAL lets the search workers read while another thread writes
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('CREATE TABLE IF NOT EXISTS metadata '
+                     '(key TEXT PRIMARY KEY, value TEXT, fetched_at INTEGER, snapshot_id TEXT)')
+        connections[key] = conn
+    return conn
+
+def metadata_cache_get(key, ttl, snapshot_id=None):
+    """Return cached metadata for key, or None if missing, expired or from another playlist snapshot"""
+    if not METADATA_CACHE_PATH:
+        return None
+    try:
+        row = open_metadata_cache().execute('SELECT value, fetched_at, snapshot_id FROM metadata WHERE key = ?',
+                                            (key,)).fetchone()
+    except sqlite3.Error:
+        return None
+    if not row:
+        return None
+    value, fetched_at, cached_snapshot_id = row
+    if time.time() - fetched_at > ttl:
+        return None
+    if snapshot_id is not None and snapshot_id != cached_snapshot_id:
+        return None
+    return json.loads(value)
+
+def metadata_cache_put(key, value, snapshot_id=None):
+    if not METADATA_CACHE_PATH:
+        return
+    try:
+        with open_metadata_cache() as conn:
+            conn.execute('INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?)',
+                         (key, json.dumps(value, ensure_ascii=False), int(time.time()), snapshot_id))
+    except sqlite3.Error:
+        pass
+
+def metadata_cache_delete(key):
+    if not METADATA_CACHE_PATH:
+        return
+    try:
+        with open_metadata_cache() as conn:
+            conn.execute('DELETE FROM metadata WHERE key = ?', (key,))
+    except sqlite3.Error:
+        pass
+
+def iter_spotify_pages(fetch_page, limit, total=None):
+    """Yield each page of a Spotify paging endpoint in order as it arrives.
+
+    When the item count is already known every page is requested concurrently; otherwise the
+    first page supplies it and only the remaining pages are fetched in parallel.
+    """
+    if total is None:
+        first_page = spotify_call(fetch_page, limit=limit, offset=0)
+        yield first_page
+        total = first_page.get('total') or 0
+        offsets = range(limit, total, limit)
+    else:
+        offsets = range(0, total, limit)
+    if offsets:
+        with ThreadPoolExecutor(max_workers=SPOTIFY_PAGE_WORKERS) as executor:
+            yield from executor.map(lambda offset: spotify_call(fetch_page, limit=limit, offset=offset), offsets)
+
+def fetch_spotify_pages(fetch_page, limit, total=None):
+    """Fetch all items of a Spotify paging endpoint"""
+    return [item for page in iter_spotify_pages(fetch_page, limit, total) for item in page['items']]
+
+def spotify_track_to_song(track, album_name, collection):
+    return {'name': track['name'],
+            'artist': ', '.join([a['name'] for a in track['artists']]),
+            'album': album_name, 'uri': track['uri'],
+            'source': 'spotify', 'collection': collection}
+
+def intern_song_fields(songs):
+    """Share one str object per distinct source/collection across songs decoded from the cache.
+
+    json.loads makes a fresh copy of these values for every song; interned, they cost one string
+    per playlist instead of one per song, and equality checks on them become identity checks.
+    """
+    for song in songs:
+        song['source'] = sys.intern(song['source'])
+        song['collection'] = sys.intern(song['collection'])
+    return songs
+
+def fetch_spotify_playlist_songs(client, playlist_id, playlist_name, snapshot_id=None, total=None):
+    if snapshot_id is None:
+        playlist = spotify_call(client.playlist, playlist_id, fields='snapshot_id,tracks.total')
+        snapshot_id, total = playlist['snapshot_id'], playlist['tracks']['total']
+    cache_key = f"playlist_tracks:{playlist_id}:{playlist_name}"
+    songs = metadata_cache_get(cache_key, METADATA_CACHE_TTL_PLAYLIST_TRACKS, snapshot_id)
+    if songs is not None:
+        return intern_song_fields(songs)
+    items = fetch_spotify_pages(partial(client.playlist_tracks, playlist_id,
+                                        fields=SPOTIFY_PLAYLIST_TRACK_FIELDS), 100, total)
+    songs = [spotify_track_to_song(item['track'], item['track']['album']['name'], playlist_name)
+             for item in items if item['track']]
+    metadata_cache_put(cache_key, songs, snapshot_id)
+    return songs
+
+def spotify_lookup_client():
+    client = init_spotify() if SPOTIFY_CLIENT_ID and SPOTIFY_CLIENT_SECRET else None
+    return client or init_spotify_public()
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    return iter(lambda: list(islice(iterator, size)), [])
+
+def get_spotify_tracks(track_ids, collection='Spotify Tracks'):
+    """Look up individual tracks through /tracks, 50 IDs per request instead of one request each"""
+    client = spotify_lookup_client()
+    if not client:
+        print("✗ Spotify track lookup requires SPOTIFY_CLIENT_ID and SPOTIFY_CLIENT_SECRET.")
+        return []
+    songs = []
+    try:
+        for chunk in chunked(track_ids, 50):
+            response = spotify_call(client.tracks, chunk)
+            songs.extend(spotify_track_to_song(track, track['album']['name'], collection)
+                         for track in response['tracks'] if track)
+    except Exception as e:
+        print(f"✗ Error: {e}")
+    print(f"✓ Found: {collection} ({len(songs)} tracks)")
+    return songs
 
 def get_spotify_playlist_from_url(spotify_url):
     item_id, url_type = parse_spotify_url(spotify_url)
@@ -485,68 +1303,60 @@ def get_spotify_playlist_from_url(spotify_url):
         print(f"✗ Invalid Spotify URL (use playlist or album)")
         return None, []
     try:
-        client = init_spotify() if SPOTIFY_CLIENT_ID and SPOTIFY_CLIENT_SECRET else None
-        if not client:
-            client = init_spotify_public()
+        client = spotify_lookup_client()
         if not client:
             print("✗ Spotify playlist/album lookup requires SPOTIFY_CLIENT_ID and SPOTIFY_CLIENT_SECRET.")
             return None, []
         
-        songs = []
         if url_type == 'album':
-            album = client.album(item_id)
+            album = spotify_call(client.album, item_id)
             collection_name = album['name']
-            for track in album['tracks']['items']:
-                songs.append({'name': track['name'],
-                            'artist': ', '.join([a['name'] for a in track['artists']]),
-                            'album': collection_name, 'uri': track['uri'],
-                            'source': 'spotify', 'collection': collection_name})
+            songs = [spotify_track_to_song(track, collection_name, collection_name)
+                     for track in album['tracks']['items']]
         else:  # playlist
-            playlist = client.playlist(item_id)
+            playlist = spotify_call(client.playlist, item_id, fields='name,snapshot_id,tracks.total')
             collection_name = playlist['name']
-            offset = 0
-            while True:
-                results = client.playlist_tracks(item_id, limit=100, offset=offset)
-                if not results['items']:
-                    break
-                for item in results['items']:
-                    if item['track']:
-                        track = item['track']
-                        songs.append({'name': track['name'], 
-                                    'artist': ', '.join([a['name'] for a in track['artists']]),
-                                    'album': track['album']['name'], 'uri': track['uri'],
-                                    'source': 'spotify', 'collection': collection_name})
-                offset += 100
-                if len(results['items']) < 100:
-                    break
+            songs = fetch_spotify_playlist_songs(client, item_id, collection_name, playlist['snapshot_id'],
+                                                 playlist['tracks']['total'])
         print(f"✓ Found: {collection_name} ({len(songs)} tracks)")
         return collection_name, songs
     except Exception as e:
         print(f"✗ Error: {e}")
         return None, []
 
+status_line = threading.local()
+
+
+def print_status(message, interval=0.1):
+    """Redraw the carriage-return status line at most every `interval` seconds rather than once per item"""
+    now = time.monotonic()
+    if now - getattr(status_line, 'last_printed', 0.0) >= interval:
+        status_line.last_printed = now
+        print(message, end='\r')
+
+def iter_spotify_liked_songs(client):
+    """Yield liked songs page by page, so raw page JSON is released as soon as it has been converted"""
+    # /me/tracks has no `fields` filter, but naming a market drops the long available_markets
+    # arrays from every track and album, which are most of each page's bytes
+    for page in iter_spotify_pages(partial(client.current_user_saved_tracks, market='from_token'), 50):
+        for item in page['items']:
+            yield spotify_track_to_song(item['track'], item['track']['album']['name'], 'Spotify Liked Songs')
+
 def get_spotify_liked_songs():
     sp = init_spotify()
     if not sp:
         return []
+    liked_songs = metadata_cache_get('liked_songs', METADATA_CACHE_TTL_LIKED)
+    if liked_songs is not None:
+        print(f"✓ Loaded {len(liked_songs)} liked songs from cache")
+        return intern_song_fields(liked_songs)
     print("Fetching Spotify liked songs...")
     liked_songs = []
-    offset = 0
     try:
-        while True:
-            results = sp.current_user_saved_tracks(limit=50, offset=offset)
-            if not results['items']:
-                break
-            for item in results['items']:
-                track = item['track']
-                liked_songs.append({'name': track['name'], 
-                                  'artist': ', '.join([a['name'] for a in track['artists']]),
-                                  'album': track['album']['name'], 'uri': track['uri'],
-                                  'source': 'spotify', 'collection': 'Spotify Liked Songs'})
-            offset += 50
-            print(f"  Fetched {len(liked_songs)} songs...", end='\r')
-            if len(results['items']) < 50:
-                break
+        for song in iter_spotify_liked_songs(sp):
+            liked_songs.append(song)
+            print_status(f"  Fetched {len(liked_songs)} songs...")
+        metadata_cache_put('liked_songs', liked_songs)
     except SpotifyException as e:
         if is_spotify_app_premium_required_error(e):
             print("\n✗ Spotify API denied access to liked songs.")
@@ -561,23 +1371,22 @@ def get_spotify_liked_songs():
     print(f"\nFound {len(liked_songs)} songs")
     return liked_songs
 
+def iter_spotify_playlists(client):
+    """Yield the user's playlists page by page; only the fields the menu needs are kept from each raw page"""
+    for page in iter_spotify_pages(client.current_user_playlists, 50):
+        for p in page['items']:
+            yield {'id': p['id'], 'name': p['name'], 'tracks_total': p['tracks']['total'], 'source': 'spotify'}
+
 def get_spotify_playlists():
     sp = init_spotify()
     if not sp:
         return []
-    playlists = []
-    offset = 0
+    playlists = metadata_cache_get('playlists', METADATA_CACHE_TTL_PLAYLISTS)
+    if playlists is not None:
+        return playlists
     try:
-        while True:
-            results = sp.current_user_playlists(limit=50, offset=offset)
-            if not results['items']:
-                break
-            for p in results['items']:
-                playlists.append({'id': p['id'], 'name': p['name'], 
-                                'tracks_total': p['tracks']['total'], 'source': 'spotify'})
-            offset += 50
-            if len(results['items']) < 50:
-                break
+        playlists = list(iter_spotify_playlists(sp))
+        metadata_cache_put('playlists', playlists)
     except SpotifyException as e:
         if is_spotify_app_premium_required_error(e):
             print("\n✗ Spotify API denied access to playlists.")
@@ -595,23 +1404,8 @@ def get_spotify_playlist_songs(playlist_id, playlist_name):
     sp = init_spotify()
     if not sp:
         return []
-    songs = []
-    offset = 0
     try:
-        while True:
-            results = sp.playlist_tracks(playlist_id, limit=100, offset=offset)
-            if not results['items']:
-                break
-            for item in results['items']:
-                if item['track']:
-                    track = item['track']
-                    songs.append({'name': track['name'], 
-                                'artist': ', '.join([a['name'] for a in track['artists']]),
-                                'album': track['album']['name'], 'uri': track['uri'],
-                                'source': 'spotify', 'collection': playlist_name})
-            offset += 100
-            if len(results['items']) < 100:
-                break
+        songs = fetch_spotify_playlist_songs(sp, playlist_id, playlist_name)
     except SpotifyException as e:
         if is_spotify_app_premium_required_error(e):
             print(f"  ✗ Spotify API denied playlist tracks for '{playlist_name}'.")
@@ -625,15 +1419,22 @@ def get_spotify_playlist_songs(playlist_id, playlist_name):
         return []
     return songs
 
+def get_spotify_playlists_songs(playlists):
+    """Fetch several playlists at once; spotify_call's rate limiter and request slots still pace the requests"""
+    print(f"\nFetching {len(playlists)} playlist(s)...")
+    with ThreadPoolExecutor(max_workers=SPOTIFY_PAGE_WORKERS) as executor:
+        results = executor.map(lambda p: get_spotify_playlist_songs(p['id'], p['name']), playlists)
+        songs = []
+        for playlist, playlist_songs in zip(playlists, results):
+            print(f"  ✓ {playlist['name']}: {len(playlist_songs)} tracks")
+            songs.extend(playlist_songs)
+    return songs
+
 # ============ YOUTUBE MUSIC FUNCTIONS ============
 def parse_youtube_url(url):
-    patterns = [r'list=([a-zA-Z0-9_-]+)', r'youtube\.com/playlist\?list=([a-zA-Z0-9_-]+)',
-                r'music\.youtube\.com/playlist\?list=([a-zA-Z0-9_-]+)']
-    for pattern in patterns:
-        match = re.search(pattern, url)
-        if match:
-            return match.group(1)
-    return None
+    """The list= query parameter of youtube.com/playlist, music.youtube.com/playlist and watch?v=...&list= URLs"""
+    playlist_ids = parse_qs(urlsplit(url).query).get('list')
+    return playlist_ids[0] if playlist_ids else None
 
 def get_ytmusic_liked_songs():
     liked_songs = []
@@ -651,7 +1452,7 @@ def get_ytmusic_liked_songs():
                         liked_songs.append({'name': song.strip(), 'artist': artist.strip(),
                                             'album': 'Unknown', 'videoId': entry.get('id', ''),
                                             'source': 'ytmusic', 'collection': 'YouTube Music Liked Songs'})
-                        print(f"  Fetched {len(liked_songs)} songs...", end='\r')
+                        print_status(f"  Fetched {len(liked_songs)} songs...")
                 except:
                     continue
     except Exception as e:
@@ -692,34 +1493,197 @@ def get_ytmusic_playlist_from_url(playlist_url):
         print(f"✗ Error: {e}")
     return playlist_name, songs
 
+def iter_playlist_urls(lines):
+    """Yield the URLs in playlists.txt as the file is read, skipping blanks and # comments"""
+    for line in lines:
+        url = line.strip()
+        if url and not url.startswith('#'):
+            yield url
+
+SPOTIFY_URL_RE = re.compile(r'spotify\.com|spotify:')
+YOUTUBE_URL_RE = re.compile(r'youtube\.com|youtu\.be')
+
+
+def fetch_playlist_url(url):
+    if SPOTIFY_URL_RE.search(url):
+        _, songs = get_spotify_playlist_from_url(url)
+    elif YOUTUBE_URL_RE.search(url):
+        _, songs = get_ytmusic_playlist_from_url(url)
+    else:
+        print(f"  ✗ Unrecognized URL: {url}")
+        songs = []
+    return songs or []
+
 def process_playlists_file():
-    if not os.path.exists('playlists.txt'):
+    # Open straight away instead of stat-ing first; a missing file is the only case to handle
+    try:
+        playlists_file = open('playlists.txt', 'r', encoding='utf-8')
+    except FileNotFoundError:
         return []
     print("\n📁 Processing playlists.txt...")
-    all_songs = []
-    with open('playlists.txt', 'r', encoding='utf-8') as f:
-        urls = [line.strip() for line in f if line.strip() and not line.startswith('#')]
-    print(f"Found {len(urls)} URLs\n")
-    for i, url in enumerate(urls, 1):
-        print(f"[{i}/{len(urls)}] {url}")
-        if 'spotify.com' in url or 'spotify:' in url:
-            _, songs = get_spotify_playlist_from_url(url)
-            if songs:
-                all_songs.extend(songs)
-        elif 'youtube.com' in url or 'music.youtube.com' in url:
-            _, songs = get_ytmusic_playlist_from_url(url)
-            if songs:
-                all_songs.extend(songs)
-        else:
-            print("  ✗ Unrecognized URL")
-        print()
+    # Each URL is submitted as soon as it is read, so the first fetch starts before the file is fully parsed.
+    # Single track URLs are held back and looked up together in batches once the whole file is read; each
+    # keeps its slot in entries so songs still come out in the file's order
+    with playlists_file, ThreadPoolExecutor(max_workers=SPOTIFY_PAGE_WORKERS) as executor:
+        entries, track_ids = [], []
+        for url in iter_playlist_urls(playlists_file):
+            item_id, url_type = parse_spotify_url(url) if SPOTIFY_URL_RE.search(url) else (None, None)
+            if url_type == 'track':
+                track_ids.append(item_id)
+                entries.append(f'spotify:track:{item_id}')
+            else:
+                entries.append(executor.submit(fetch_playlist_url, url))
+        print(f"Found {len(entries)} URLs\n")
+        tracks = {song['uri']: song for song in get_spotify_tracks(track_ids)} if track_ids else {}
+        all_songs = []
+        for entry in entries:
+            if isinstance(entry, str):
+                if entry in tracks:
+                    all_songs.append(tracks[entry])
+            else:
+                all_songs.extend(entry.result())
+    print()
     return all_songs
 
-def process_song(song, download, index, total, output_template=None):
+# Featured-artist credits, e.g. "Song (feat. X)", "Song [ft. X]", "Song feat. X"
+FEATURE_CREDIT_RE = re.compile(r'[(\[]\s*(?:feat|ft|featuring)\b[^)\]]*[)\]]|\s(?:feat\.|ft\.|featuring)\s.*$')
+PUNCTUATION_RE = re.compile(r'[^\w\s]')
+WHITESPACE_RE = re.compile(r'\s+')
+
+
+@lru_cache(maxsize=16384)
+def normalize_song_text(text):
+    """Fold case, accents, punctuation and featured-artist credits so near-identical titles compare equal"""
+    folded = unicodedata.normalize('NFKD', text).casefold()
+    normalized = PUNCTUATION_RE.sub('', FEATURE_CREDIT_RE.sub('', folded))
+    normalized = WHITESPACE_RE.sub(' ', normalized).strip()
+    return normalized or folded.strip()
+
+def dedupe_songs(songs):
+    """Drop repeated songs (same normalized title and primary artist), keeping the first occurrence"""
+    unique = {}
+    for song in songs:
+        # Exact tuple keys rather than bare hash() fingerprints: a collision would silently drop a song
+        key = (normalize_song_text(song['name']), normalize_song_text(song['artist'].partition(',')[0]))
+        if key not in unique:
+            unique[key] = song
+    return list(unique.values())
+
+def interleave_by_collection(songs):
+    """Round-robin songs across their collections, so concurrent downloads aren't all back-to-back
+    tracks of one playlist (which tend to hit the same uploaders and trip YouTube's throttling)"""
+    groups = {}
+    for song in songs:
+        groups.setdefault(song.get('collection'), []).append(song)
+    return [song for round_ in zip_longest(*groups.values()) for song in round_ if song is not None]
+
+def run_adaptive(executor, jobs, concurrency):
+    """Submit (fn, args) jobs no faster than concurrency.limit allows and yield (job, future) as each finishes.
+
+    A finished job whose result dict is marked 'throttled' halves the limit; clean ones slowly raise it again.
+    """
+    jobs, pending = iter(jobs), {}
+    while True:
+        while len(pending) < concurrency.limit:
+            job = next(jobs, None)
+            if job is None:
+                break
+            pending[executor.submit(*job)] = job
+        if not pending:
+            return
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            job = pending.pop(future)
+            try:
+                throttled = bool(future.result()[1].get('throttled'))
+            except Exception:
+                throttled = False
+            concurrency.record(throttled)
+            yield job, future
+
+def load_download_manifest():
+    global download_manifest
+    try:
+        with open(DOWNLOAD_MANIFEST, 'r', encoding='utf-8') as f:
+            download_manifest = json.load(f)
+    except (OSError, ValueError):
+        download_manifest = {}
+    # main truncates results.jsonl next, so whatever was recovered from it must be on disk first
+    if recover_manifest_from_results(RESULTS_JSONL):
+        save_download_manifest()
+    return download_manifest
+
+def recover_manifest_from_results(jsonl_path):
+    """A run that was interrupted never saved its manifest, but its results.jsonl lists every song it finished"""
+    loads = orjson.loads if orjson is not None else json.loads
+    recovered = 0
+    try:
+        with open(jsonl_path, 'rb') as f:
+            for line in f:
+                try:
+                    result = loads(line)
+                except ValueError:
+                    continue  # last line may be cut off mid-write
+                path = get_result_download_path(result)
+                if path and result.get('spotify'):
+                    download_manifest[song_manifest_key(result['spotify'])] = path
+                    recovered += 1
+    except OSError:
+        pass
+    return recovered
+
+def save_download_manifest():
+    write_json_file(DOWNLOAD_MANIFEST, download_manifest)
+
+def song_manifest_key(song):
+    return f"{song['artist']}|{song['name']}"
+
+def get_downloaded_path(song):
+    """Return the file a previous run downloaded for this song, if it is still on disk"""
+    path = download_manifest.get(song_manifest_key(song))
+    if path and os.path.isfile(path) and os.path.getsize(path) > 0:
+        return path
+    return None
+
+def get_result_download_path(result):
+    return result.get('download_path') or (result.get('youtube') or {}).get('download_path')
+
+def init_download_worker(zotify_enabled, manifest, cookie=None, slots=None):
+    """ProcessPoolExecutor initializer: carry over state set in the parent after import"""
+    global zotify_available, download_manifest, ytmusic_cookie, transcode_slots
+    zotify_available = zotify_enabled
+    download_manifest = manifest
+    ytmusic_cookie = cookie
+    if slots is not None:
+        transcode_slots = slots
+
+def create_download_executor(workers):
+    """Process pool for downloads, so yt-dlp's per-track Python work runs outside this process's GIL.
+
+    Workers are spawned rather than forked from this already multi-threaded process; the initializer
+    hands them the state main set up after import. transcode_slots is replaced by one semaphore shared
+    with the workers, so main's transcode pool and any song a worker transcodes itself draw on the same slots.
+    """
+    global transcode_slots
+    context = multiprocessing.get_context('spawn')
+    transcode_slots = context.Semaphore(TRANSCODE_WORKERS)
+    return ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=init_download_worker,
+                               initargs=(zotify_available, download_manifest, ytmusic_cookie, transcode_slots))
+
+def process_song(song, download, index, total, output_template=None, youtube_match=None, searched=False,
+                 subfolder=None, defer_transcode=False):
     result = {'spotify': song, 'youtube': None}
-    collection = song.get('collection', 'Unknown')
-    safe_subfolder = "".join(c for c in collection if c.isalnum() or c in (' ', '-', '_')).strip()
+    safe_subfolder = subfolder if subfolder is not None else sanitize_filename(song.get('collection', 'Unknown'))
+    download_state.throttled = False
+    download_state.already_downloaded = False
     try:
+        if download:
+            existing_path = get_downloaded_path(song)
+            if existing_path:
+                result['download_path'] = existing_path
+                result['already_downloaded'] = True
+                return (True, result, f"[{index}/{total}] ⏭ Already downloaded: {song['name']} - {song['artist']}")
+
         if song.get('source') == 'spotify' and download and zotify_available:
             spotify_path = download_with_zotify(song.get('uri'), song['name'], song['artist'], safe_subfolder)
             if spotify_path:
@@ -727,23 +1691,36 @@ def process_song(song, download, index, total, output_template=None):
                 result['download_path'] = spotify_path
                 return (True, result, f"[{index}/{total}] ✓ Spotify: {song['name']} - {song['artist']}")
         
-        if song.get('source') == 'ytmusic' and song.get('videoId'):
-            video_url = f"https://www.youtube.com/watch?v={song['videoId']}"
-            result['youtube'] = {'title': song['name'], 'url': video_url, 'id': song['videoId']}
-            if download:
-                download_path = download_youtube_audio(video_url, song['name'], song['artist'], safe_subfolder, output_template=output_template)
-                if download_path:
-                    result['youtube']['download_path'] = download_path
-                    return (True, result, f"[{index}/{total}] ✓ YouTube: {song['name']} - {song['artist']}")
+        if not searched and song.get('source') == 'ytmusic' and song.get('videoId'):
+            youtube_match, searched = ytmusic_video_match(song), True
+
+        if searched:
+            # YouTube match was already resolved (batched search phase in main, or a YouTube Music video ID)
+            yt_result = dict(youtube_match) if youtube_match else None
+            if yt_result and download:
+                download_args = (yt_result['url'], song['name'], song['artist'], safe_subfolder, output_template)
+                if defer_transcode:
+                    yt_result['download_path'], fetched = fetch_youtube_audio(*download_args)
+                    if fetched:
+                        # Source audio is on disk; main's transcode pool finishes the song (finish_transcode)
+                        # while this worker moves on to its next fetch
+                        result['youtube'] = yt_result
+                        result['transcode'] = (index, total, fetched)
+                        return (True, result, '')
                 else:
-                    return (False, result, f"[{index}/{total}] ✗ Failed: {song['name']}")
-            else:
-                return (True, result, f"[{index}/{total}] ✓ Found: {song['name']}")
-        
-        yt_result = search_youtube_for_song(song['name'], song['artist'], download=download, subfolder=safe_subfolder, output_template=output_template)
+                    yt_result['download_path'] = download_youtube_audio(*download_args)
+                if not yt_result['download_path'] and song.get('source') != 'ytmusic':
+                    metadata_cache_delete(youtube_search_cache_key(song['name'], song['artist']))
+        else:
+            yt_result = search_youtube_for_song(song['name'], song['artist'], download=download, subfolder=safe_subfolder, output_template=output_template)
         result['youtube'] = yt_result
+        if download_state.throttled:
+            result['throttled'] = True
         if yt_result:
             if download:
+                if download_state.already_downloaded:
+                    result['already_downloaded'] = True
+                    return (True, result, f"[{index}/{total}] ⏭ Already downloaded: {song['name']} - {song['artist']}")
                 if yt_result.get('download_path'):
                     return (True, result, f"[{index}/{total}] ✓ YouTube: {song['name']} - {song['artist']}")
                 return (False, result, f"[{index}/{total}] ✗ Failed: {song['name']}")
@@ -752,6 +1729,71 @@ def process_song(song, download, index, total, output_template=None):
     except Exception as e:
         return (False, result, f"[{index}/{total}] ✗ Error: {song['name']}")
 
+def finish_transcode(song, result):
+    """Transcode stage for a song process_song left fetched; returns (success, result, message) like process_song"""
+    index, total, fetched = result.pop('transcode')
+    yt_result = result['youtube']
+    try:
+        yt_result['download_path'] = transcode_download(**fetched)
+    except Exception:
+        yt_result['download_path'] = None
+    if yt_result['download_path']:
+        return (True, result, f"[{index}/{total}] ✓ YouTube: {song['name']} - {song['artist']}")
+    if song.get('source') != 'ytmusic':
+        metadata_cache_delete(youtube_search_cache_key(song['name'], song['artist']))
+    return (False, result, f"[{index}/{total}] ✗ Failed: {song['name']}")
+
+def transcode_completed(completed, executor, max_waiting):
+    """Pass finished songs through, handing fetched-only ones to finish_transcode on executor first.
+
+    Download workers return as soon as a song's source audio is on disk, so their next fetch overlaps
+    this song's ffmpeg run. Once max_waiting fetched files are queued for ffmpeg, no further downloads
+    are collected (and so none submitted) until a transcode finishes, bounding the disk they take up.
+    """
+    transcodes = {}
+
+    def finished(timeout):
+        done, _ = wait(transcodes, timeout=timeout, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield transcodes.pop(future), future.result()
+
+    for song, outcome in completed:
+        yield from finished(0)
+        if 'transcode' not in outcome[1]:
+            yield song, outcome
+            continue
+        transcodes[executor.submit(finish_transcode, song, outcome[1])] = song
+        while len(transcodes) >= max_waiting:
+            yield from finished(None)
+    while transcodes:
+        yield from finished(None)
+
+def process_songs_concurrent(executor, songs, download, concurrency=None, output_template=None, youtube_matches=None,
+                             defer_transcode=False):
+    """Run process_song for every song on executor, yielding (song, (success, result, message)) as each finishes"""
+    if concurrency is None:
+        concurrency = AdaptiveConcurrency(MAX_CONCURRENT_DOWNLOADS, MAX_CONCURRENT_DOWNLOADS)
+    youtube_matches = youtube_matches or {}
+    # Folder names are sanitized once per collection rather than once per song
+    subfolders = {collection: sanitize_filename(collection)
+                  for collection in {song.get('collection', 'Unknown') for song in songs}}
+    jobs = ((process_song, song, download, i, len(songs), output_template,
+             youtube_matches.get(id(song)), id(song) in youtube_matches,
+             subfolders[song.get('collection', 'Unknown')], defer_transcode)
+            for i, song in enumerate(interleave_by_collection(songs), 1))
+    for job, future in run_adaptive(executor, jobs, concurrency):
+        yield job[1], future.result()
+
+SELECTION_RE = re.compile(r'[\d,\s]*')
+NUMBER_RE = re.compile(r'\d+')
+
+
+def parse_selection(choice):
+    """Turn a menu answer like "1, 3,5" into 0-based indices; raises ValueError on anything but numbers and commas"""
+    if not SELECTION_RE.fullmatch(choice):
+        raise ValueError(f"invalid selection: {choice!r}")
+    return [int(number) - 1 for number in NUMBER_RE.findall(choice)]
+
 def main():
     args = parse_args()
     print("=== Spotify & YouTube Music Downloader ===\n")
@@ -761,6 +1803,10 @@ def main():
     if zotify_available:
         print("✓ Zotify: Spotify OGG Vorbis ~320kbps → YouTube fallback")
     print(f"\nFormat: {AUDIO_FORMAT} | Quality: {AUDIO_QUALITY}\n")
+    if AUDIO_FORMAT not in VALID_AUDIO_FORMATS:
+        print(f"⚠️  Unknown AUDIO_FORMAT '{AUDIO_FORMAT}'; files will be encoded as mp3")
+    if AUDIO_QUALITY not in VALID_AUDIO_QUALITIES:
+        print(f"⚠️  Unusual AUDIO_QUALITY '{AUDIO_QUALITY}'; expected one of {', '.join(sorted(VALID_AUDIO_QUALITIES))}")
     
     all_songs = []
     if os.path.exists('playlists.txt'):
@@ -811,16 +1857,14 @@ def main():
                                 selected = playlists
                             else:
                                 try:
-                                    indices = [int(x.strip())-1 for x in choice.split(',') if x.strip()]
+                                    indices = parse_selection(choice)
                                     selected = [playlists[i] for i in indices if 0 <= i < len(playlists)]
                                     if not selected:
                                         print("No valid playlists selected. Try again.")
                                 except ValueError:
                                     print("Invalid input. Enter numbers separated by commas or 'all'.")
                         
-                        for p in selected:
-                            print(f"\nFetching '{p['name']}'...")
-                            all_songs.extend(get_spotify_playlist_songs(p['id'], p['name']))
+                        all_songs.extend(get_spotify_playlists_songs(selected))
                 if spotify_choice == '4':
                     url = input("\nSpotify URL: ")
                     _, songs = get_spotify_playlist_from_url(url)
@@ -843,14 +1887,7 @@ def main():
                 url = input("\nYouTube Music URL: ")
                 _, songs = get_ytmusic_playlist_from_url(url)
                 all_songs.extend(songs)
-    # Remove duplicates
-    unique_songs = []
-    seen = set()
-    for song in all_songs:
-        identifier = f"{song['name']}|{song['artist']}"
-        if identifier not in seen:
-            seen.add(identifier)
-            unique_songs.append(song)
+    unique_songs = dedupe_songs(all_songs)
     
     print(f"\n\nTotal: {len(unique_songs)} unique songs")
     if len(unique_songs) > 1000:
@@ -858,33 +1895,66 @@ def main():
             return
     
     action = "Downloading" if download_songs else "Processing"
-    print(f"\n{action} with {MAX_CONCURRENT_DOWNLOADS} workers...\n")
+    if download_songs:
+        load_download_manifest()
+        # Worker processes only fetch; fetched songs go to a pool of TRANSCODE_WORKERS threads here (ffmpeg
+        # runs as a subprocess), so network and CPU work overlap
+        workers = MAX_CONCURRENT_DOWNLOADS
+        executor = create_download_executor(workers)
+        # Start at half the pool and let clean downloads earn the rest; YouTube 429s halve it again
+        concurrency = AdaptiveConcurrency((workers + 1) // 2, workers)
+    else:
+        workers = MAX_CONCURRENT_DOWNLOADS
+        executor = ThreadPoolExecutor(max_workers=workers)
+        concurrency = AdaptiveConcurrency(workers, workers)
+
+    # Resolve YouTube matches up front at search concurrency, then hand every song to one download pool
+    youtube_matches = resolve_youtube_matches(unique_songs, download_songs)
+
+    print(f"\n{action} with {workers} workers...\n")
     
-    results = []
     successful = 0
+    spotify_direct = 0
+    already_downloaded = 0
     
-    # Process songs with threading for better performance
-    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_DOWNLOADS) as executor:
-        futures = {executor.submit(process_song, song, download_songs, i, len(unique_songs), args.output_template): song
-                  for i, song in enumerate(unique_songs, 1)}
-        for future in as_completed(futures):
-            success, result, message = future.result()
-            print(message)
-            results.append(result)
+    # Threads are only started once a song is handed over, so this costs nothing when not downloading
+    transcoder = ThreadPoolExecutor(max_workers=TRANSCODE_WORKERS)
+    # Each result is appended to results.jsonl as soon as it completes, so progress survives a crash
+    with executor, transcoder, open(RESULTS_JSONL, 'wb') as results_file:
+        completed = process_songs_concurrent(executor, unique_songs, download_songs, concurrency,
+                                             args.output_template, youtube_matches, defer_transcode=download_songs)
+        # At most two fetched files per transcode thread wait for ffmpeg
+        completed = transcode_completed(completed, transcoder, 2 * TRANSCODE_WORKERS)
+        # Only this thread prints; with tqdm installed, a rate-limited progress bar sits under the messages
+        report = print
+        if tqdm is not None:
+            completed = tqdm(completed, total=len(unique_songs), unit='song', mininterval=0.1)
+            report = tqdm.write
+        for song, (success, result, message) in completed:
+            report(message)
+            results_file.write(dumps_json_line(result))
+            results_file.flush()
+            spotify_direct += bool(result.get('spotify_direct'))
+            already_downloaded += bool(result.get('already_downloaded'))
             if success:
                 successful += 1
+                if download_songs and get_result_download_path(result):
+                    download_manifest[song_manifest_key(song)] = get_result_download_path(result)
     
-    with open('results.json', 'w', encoding='utf-8') as f:
-        json.dump(results, f, indent=2, ensure_ascii=False)
+    if download_songs:
+        save_download_manifest()
+
+    convert_jsonl_to_json(RESULTS_JSONL, 'results.json')
     
     print(f"\n\n=== Summary ===")
     print(f"Processed: {len(unique_songs)}")
     print(f"Successful: {successful}")
     print(f"Failed: {len(unique_songs) - successful}")
     if download_songs:
-        spotify_direct = sum(1 for r in results if r.get('spotify_direct'))
         if spotify_direct:
             print(f"Direct Spotify: {spotify_direct}")
+        if already_downloaded:
+            print(f"Already downloaded: {already_downloaded}")
         print(f"\nLocation: {os.path.abspath(DOWNLOAD_FOLDER)}/")
     print(f"Results: results.json")
 
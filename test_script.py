@@ -1,62 +1,513 @@
 """Tests - Run with pytest test_script.py -v"""
+import json
+import threading
+import time
 import pytest
-from pathlib import Path
 from unittest.mock import patch, MagicMock
 import script
 
 
+@pytest.fixture(autouse=True)
+def isolated_metadata_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(script, 'METADATA_CACHE_PATH', str(tmp_path / 'metadata_cache.db'))
+
+
+@pytest.fixture
+def spotify_client(monkeypatch):
+    """One mock Spotify client, installed as both script.sp and init_spotify's return value"""
+    client = MagicMock()
+    monkeypatch.setattr(script, 'sp', client)
+    monkeypatch.setattr(script, 'init_spotify', lambda: client)
+    return client
+
+
+class TestYoutubeDLReuse:
+    def test_search_instance_reused_within_thread(self):
+        assert script.get_search_ydl() is script.get_search_ydl()
+
+    def test_download_instance_per_cookiefile(self, tmp_path):
+        cookiefile = str(tmp_path / 'cookies.txt')
+        assert script.get_download_ydl() is script.get_download_ydl()
+        assert script.get_download_ydl() is not script.get_download_ydl(cookiefile)
+
+    def test_ytmusic_instance_reloads_only_changed_cookie(self):
+        ydl = script.get_ytmusic_ydl('SID=one')
+        assert script.get_ytmusic_ydl('SID=one') is ydl
+        script.get_ytmusic_ydl('HSID=two')
+        assert {c.name for c in ydl.cookiejar} == {'HSID'}
+
+    def test_instances_closed_at_exit(self, monkeypatch):
+        ydl = MagicMock()
+        monkeypatch.setattr(script, 'created_ytdlp_instances', [ydl])
+        script.close_ytdlp_instances()
+        assert ydl.close.called and script.created_ytdlp_instances == []
+
+
+class TestYouTubeSearch:
+    @patch('script.get_search_ydl')
+    @patch('script.init_ytmusic')
+    def test_prefers_ytmusic_result(self, mock_init, mock_ydl):
+        mock_init.return_value.search.return_value = [{'title': 'Song', 'videoId': 'vid123'}]
+        result = script.search_youtube_for_song('Song', 'Artist')
+        assert result['id'] == 'vid123' and not mock_ydl.called
+
+    @patch('script.get_search_ydl')
+    @patch('script.get_http_session')
+    @patch('script.init_ytmusic')
+    def test_falls_back_to_innertube(self, mock_init, mock_session, mock_ydl):
+        mock_init.return_value.search.return_value = []
+        mock_session.return_value.post.return_value.json.return_value = {'contents': {'sectionListRenderer': {'contents': [
+            {'adSlotRenderer': {}},
+            {'itemSectionRenderer': {'contents': [
+                {'videoRenderer': {'videoId': 'first', 'title': {'runs': [{'text': 'Song'}]}}},
+                {'videoRenderer': {'videoId': 'second'}}]}}]}}}
+        result = script.search_youtube_for_song('Song', 'Artist')
+        assert result['id'] == 'first' and result['title'] == 'Song' and not mock_ydl.called
+
+    @patch('script.get_search_ydl')
+    @patch('script.search_innertube_candidates', return_value=[])
+    @patch('script.init_ytmusic')
+    def test_falls_back_to_ytdlp(self, mock_init, mock_innertube, mock_ydl):
+        mock_init.return_value.search.return_value = []
+        mock_ydl.return_value.extract_info.return_value = {'entries': [{'title': 'Song', 'id': 'abc'}]}
+        result = script.search_youtube_for_song('Song', 'Artist')
+        assert result['id'] == 'abc'
+
+    @patch('script.search_innertube_candidates', return_value=[])
+    @patch('script.init_ytmusic')
+    def test_picks_best_scoring_candidate_over_first(self, mock_init, mock_innertube):
+        mock_init.return_value.search.return_value = [
+            {'title': 'Song (Piano Cover)', 'videoId': 'cover', 'artists': [{'name': 'Someone Else'}]},
+            {'title': 'Song', 'videoId': 'original', 'artists': [{'name': 'Artist'}]}]
+        assert script.search_youtube_for_song('Song', 'Artist')['id'] == 'original'
+
+    @patch('script.search_ytdlp_candidates', return_value=[])
+    @patch('script.search_innertube_candidates', return_value=[])
+    @patch('script.init_ytmusic')
+    def test_rejects_weak_matches(self, mock_init, mock_innertube, mock_ytdlp):
+        mock_init.return_value.search.return_value = [
+            {'title': 'Completely Different Track', 'videoId': 'x', 'artists': [{'name': 'Nobody'}]}]
+        assert script.search_youtube_for_song('Song', 'Artist') is None
+
+    def test_fallback_scorer_ignores_extra_words(self, monkeypatch):
+        monkeypatch.setattr(script, 'fuzz', None)
+        candidate = {'title': 'Song (Official Video)', 'channel': 'Artist'}
+        assert script.score_youtube_candidate(candidate, 'Song', 'Artist') == 100
+
+
+class TestDownload:
+    @patch('script.get_download_ydl')
+    def test_single_threaded_ffmpeg_extract(self, mock_get, tmp_path, monkeypatch):
+        monkeypatch.setattr(script, 'DOWNLOAD_FOLDER', str(tmp_path))
+        ydl = mock_get.return_value
+        ydl.params = {'outtmpl': {'default': ''}}
+        ydl.extract_info.return_value = {'requested_downloads': [{'filepath': 'Title.webm'}]}
+        ydl.post_process.return_value = {'filepath': 'Title.opus'}
+        assert script.download_youtube_audio('https://youtube.com/watch?v=x', 'Track', 'Artist', 'Album')
+        pp_args = ydl.params['postprocessor_args']
+        assert pp_args['ffmpegextractaudio'][:2] == ['-threads', '1']
+        assert 'title=Track' in pp_args['default']
+
+    def test_m4a_remuxes_aac_source(self, monkeypatch):
+        monkeypatch.setattr(script, 'AUDIO_FORMAT', 'm4a')
+        opts = script.build_download_ydl_opts()
+        assert opts['format'].startswith('bestaudio[ext=m4a]')
+        assert opts['postprocessors'][0]['preferredcodec'] == 'm4a'
+
+    def test_opus_prefers_opus_source(self, monkeypatch):
+        monkeypatch.setattr(script, 'AUDIO_FORMAT', 'opus')
+        assert script.build_download_ydl_opts()['format'].startswith('bestaudio[acodec=opus]')
+
+    def test_mp3_vbr_option(self, monkeypatch):
+        monkeypatch.setattr(script, 'AUDIO_FORMAT', 'mp3')
+        monkeypatch.setattr(script, 'MP3_VBR', True)
+        assert script.build_download_ydl_opts()['postprocessors'][0]['preferredquality'] == '2'
+
+    @patch('script.subprocess.check_output')
+    def test_probes_ffmpeg_encoders(self, mock_output, monkeypatch):
+        script.probe_ffmpeg_encoders.cache_clear()
+        monkeypatch.setattr(script, 'FFMPEG_HW_ENCODERS', True)
+        mock_output.return_value = ('Encoders:\n A..... = Audio\n ------\n'
+                                    ' A....D aac                  AAC (Advanced Audio Coding)\n'
+                                    ' A..... aac_at               aac (AudioToolbox) (codec aac)\n')
+        try:
+            assert script.hardware_audio_encoders() == {'aac': 'aac_at'}
+        finally:
+            script.probe_ffmpeg_encoders.cache_clear()
+
+    def test_hardware_encoder_only_replaces_transcodes(self):
+        pp = script.HardwareExtractAudioPP(None, encoders={'aac': 'aac_at'}, preferredcodec='m4a')
+        with patch.object(script.FFmpegExtractAudioPP, 'run_ffmpeg') as mock_run:
+            pp.run_ffmpeg('in.webm', 'out.m4a', 'aac', ['-q:a', '1'])
+            pp.run_ffmpeg('in.m4a', 'out.m4a', 'copy', [])
+        assert mock_run.call_args_list[0].args[2] == 'aac_at'
+        assert mock_run.call_args_list[1].args[2] == 'copy'
+
+    @patch('script.subprocess.run')
+    @patch('script.get_download_ydl')
+    def test_streams_through_single_ffmpeg(self, mock_get, mock_run, tmp_path, monkeypatch):
+        monkeypatch.setattr(script, 'DOWNLOAD_FOLDER', str(tmp_path))
+        monkeypatch.setattr(script, 'STREAM_TO_FFMPEG', True)
+        monkeypatch.setattr(script, 'AUDIO_FORMAT', 'opus')
+        ydl = mock_get.return_value
+        ydl.params = {'outtmpl': {'default': ''}}
+        ydl.extract_info.return_value = {'url': 'https://rr.googlevideo.com/audio', 'acodec': 'opus',
+                                         'http_headers': {'User-Agent': 'UA'}}
+        ydl.prepare_filename.return_value = str(tmp_path / 'Uploader' / 'Title.webm')
+        mock_run.return_value.returncode = 0
+        path = script.download_youtube_audio('https://youtube.com/watch?v=x', 'Track', 'Artist')
+        command = mock_run.call_args.args[0]
+        assert path == str(tmp_path / 'Uploader' / 'Title.opus') and command[-1] == path
+        assert ydl.extract_info.call_args.kwargs['download'] is False
+        assert command[command.index('-headers') + 1] == 'User-Agent: UA\r\n'
+        assert command[command.index('-c:a') + 1] == 'copy' and 'title=Track' in command
+
+    def test_stream_transcodes_mismatched_codec(self, monkeypatch):
+        monkeypatch.setattr(script, 'AUDIO_FORMAT', 'mp3')
+        monkeypatch.setattr(script, 'AUDIO_QUALITY', 'best')
+        monkeypatch.setattr(script, 'MP3_VBR', False)
+        assert script.ffmpeg_audio_codec_args('opus') == ['-c:a', 'libmp3lame', '-b:a', '320k']
+
+    def test_init_download_worker_sets_zotify_state(self, monkeypatch):
+        monkeypatch.setattr(script, 'zotify_available', False)
+        monkeypatch.setattr(script, 'download_manifest', {})
+        script.init_download_worker(True, {'Artist|Song': 'song.opus'})
+        assert script.zotify_available and script.download_manifest == {'Artist|Song': 'song.opus'}
+
+    @patch('script.get_download_ydl')
+    def test_returns_actual_file_path(self, mock_get, tmp_path, monkeypatch):
+        monkeypatch.setattr(script, 'DOWNLOAD_FOLDER', str(tmp_path))
+        ydl = mock_get.return_value
+        ydl.params = {'outtmpl': {'default': ''}}
+        ydl.extract_info.return_value = {'requested_downloads': [{'filepath': '/music/Uploader/Title.webm'}]}
+        ydl.post_process.return_value = {'filepath': '/music/Uploader/Title.opus'}
+        assert script.download_youtube_audio('https://youtube.com/watch?v=x', 'Track', 'Artist') == '/music/Uploader/Title.opus'
+
+    @patch('script.get_download_ydl')
+    def test_fetch_and_transcode_are_separate_stages(self, mock_get, tmp_path, monkeypatch):
+        monkeypatch.setattr(script, 'DOWNLOAD_FOLDER', str(tmp_path))
+        slots = MagicMock()
+        monkeypatch.setattr(script, 'transcode_slots', slots)
+        ydl = mock_get.return_value
+        ydl.params = {'outtmpl': {'default': ''}}
+        download = {'filepath': 'Title.webm', 'thumbnails': [{'filepath': 'Title.webp'}, {'url': 'x'}]}
+        ydl.extract_info.return_value = {'requested_downloads': [download]}
+        ydl.post_process.return_value = {'filepath': 'Title.opus'}
+        script.download_youtube_audio('https://youtube.com/watch?v=x', 'Track', 'Artist')
+        assert mock_get.call_args_list[0].kwargs == {'postprocess': False}
+        ydl.post_process.assert_called_once_with('Title.webm', download, {'Title.webp': 'Title.webp'})
+        assert slots.__enter__.called
+
+    def test_fetch_only_instance_has_no_postprocessors(self):
+        assert script.build_download_ydl(postprocess=False).params['postprocessors'] == []
+
+    def test_fetch_only_instance_skips_archived_without_recording(self, tmp_path, monkeypatch):
+        archive = tmp_path / 'archive.txt'
+        archive.write_text('youtube abc\n')
+        monkeypatch.setattr(script, 'YTDLP_DOWNLOAD_ARCHIVE', str(archive))
+        fetcher = script.build_download_ydl(postprocess=False)
+        assert fetcher.params['download_archive'] is None
+        assert 'youtube abc' in fetcher.archive
+
+    @pytest.mark.parametrize('fails', [True, False])
+    def test_archive_recorded_only_after_transcode(self, fails, tmp_path, monkeypatch):
+        from yt_dlp.utils import PostProcessingError
+        archive = tmp_path / 'archive.txt'
+        monkeypatch.setattr(script, 'YTDLP_DOWNLOAD_ARCHIVE', str(archive))
+        monkeypatch.setattr(script, 'YTDLP_ADD_METADATA', False)
+        monkeypatch.setattr(script, 'YTDLP_EMBED_THUMBNAIL', False)
+        monkeypatch.setattr(script, 'hardware_audio_encoders', lambda: [])
+        ydl = script.build_download_ydl()
+        download = {'id': 'abc', 'extractor_key': 'Youtube', 'filepath': str(tmp_path / 'Title.webm')}
+
+        def run(self, info):
+            if fails:
+                raise PostProcessingError('ffmpeg exited with code 1')
+            return [], dict(info, filepath=str(tmp_path / 'Title.opus'))
+        with patch('script.get_download_ydl', return_value=ydl), \
+                patch.object(script.FFmpegExtractAudioPP, 'run', run):
+            result = script.transcode_download(download, None, [])
+        if fails:
+            assert result is None
+            assert not archive.exists()
+        else:
+            assert result == str(tmp_path / 'Title.opus')
+            assert archive.read_text() == 'youtube abc\n'
+
+    def test_transient_download_error_is_retried(self, tmp_path, monkeypatch):
+        from yt_dlp.extractor.youtube import YoutubeIE
+        from yt_dlp.utils import ExtractorError
+        monkeypatch.setattr(script, 'DOWNLOAD_FOLDER', str(tmp_path))
+        monkeypatch.setattr(script.time, 'sleep', lambda _: None)
+        monkeypatch.setattr(script.youtube_rate_limiter, 'rate', 0)
+        fetcher = script.build_download_ydl(postprocess=False)
+        error = ExtractorError('HTTP Error 503: Service Unavailable', expected=True)
+        with patch('script.get_download_ydl', return_value=fetcher), \
+                patch.object(YoutubeIE, '_real_extract', side_effect=error) as extract:
+            assert script.download_youtube_audio('https://www.youtube.com/watch?v=dQw4w9WgXcQ', 'Track', 'Artist') is None
+        assert extract.call_count == script.API_MAX_RETRIES + 1
+
+    @patch('script.get_download_ydl')
+    def test_returns_none_when_download_fails(self, mock_get, tmp_path, monkeypatch):
+        monkeypatch.setattr(script, 'DOWNLOAD_FOLDER', str(tmp_path))
+        ydl = mock_get.return_value
+        ydl.params = {'outtmpl': {'default': ''}}
+        ydl.extract_info.return_value = None
+        ydl.in_download_archive.return_value = False
+        assert script.download_youtube_audio('https://youtube.com/watch?v=x', 'Track', 'Artist') is None
+
+    @pytest.mark.parametrize('stream', [False, True])
+    def test_archived_video_reported_as_already_downloaded(self, stream, tmp_path, monkeypatch):
+        archive = tmp_path / 'archive.txt'
+        archive.write_text('youtube dQw4w9WgXcQ\n')
+        monkeypatch.setattr(script, 'YTDLP_DOWNLOAD_ARCHIVE', str(archive))
+        monkeypatch.setattr(script, 'STREAM_TO_FFMPEG', stream)
+        monkeypatch.setattr(script, 'DOWNLOAD_FOLDER', str(tmp_path))
+        monkeypatch.setattr(script, 'download_manifest', {})
+        monkeypatch.setattr(script.youtube_rate_limiter, 'rate', 0)
+        ydl = script.build_download_ydl(postprocess=stream)
+        song = {'name': 'Song', 'artist': 'Artist', 'source': 'spotify', 'collection': 'Playlist'}
+        match = {'title': 'Song', 'url': 'https://www.youtube.com/watch?v=dQw4w9WgXcQ', 'id': 'dQw4w9WgXcQ'}
+        cache_key = script.youtube_search_cache_key('Song', 'Artist')
+        script.metadata_cache_put(cache_key, match)
+        with patch('script.get_download_ydl', return_value=ydl), patch('script.subprocess.run') as mock_run:
+            success, result, message = script.process_song(song, download=True, index=1, total=1,
+                                                           youtube_match=match, searched=True)
+        assert success and result['already_downloaded'] and 'Already downloaded' in message
+        assert script.metadata_cache_get(cache_key, script.SEARCH_CACHE_TTL) == match
+        assert not mock_run.called
+
+
+class TestDownloadWorkers:
+    def test_spawned_worker_receives_parent_state(self, tmp_path, monkeypatch):
+        existing = tmp_path / 'song.opus'
+        existing.write_bytes(b'audio')
+        monkeypatch.setattr(script, 'download_manifest', {'Artist|Song': str(existing)})
+        song = {'name': 'Song', 'artist': 'Artist', 'source': 'spotify', 'collection': 'Playlist'}
+        with script.create_download_executor(1) as executor:
+            success, result, _ = executor.submit(script.process_song, song, True, 1, 1).result(timeout=60)
+        assert success and result['already_downloaded']
+
+    def test_throttled_download_is_reported(self, tmp_path, monkeypatch):
+        from yt_dlp.extractor.youtube import YoutubeIE
+        from yt_dlp.utils import ExtractorError
+        monkeypatch.setattr(script, 'DOWNLOAD_FOLDER', str(tmp_path))
+        monkeypatch.setattr(script, 'download_manifest', {})
+        monkeypatch.setattr(script.time, 'sleep', lambda _: None)
+        monkeypatch.setattr(script.youtube_rate_limiter, 'rate', 0)
+        fetcher = script.build_download_ydl(postprocess=False)
+        error = ExtractorError('HTTP Error 429: Too Many Requests', expected=True)
+        song = {'name': 'Song', 'artist': 'Artist', 'source': 'spotify', 'collection': 'Playlist'}
+        match = {'title': 'Song', 'url': 'https://www.youtube.com/watch?v=dQw4w9WgXcQ', 'id': 'dQw4w9WgXcQ'}
+        with patch('script.get_download_ydl', return_value=fetcher), \
+                patch.object(YoutubeIE, '_real_extract', side_effect=error):
+            success, result, _ = script.process_song(song, download=True, index=1, total=1, youtube_match=match,
+                                                     searched=True)
+        assert not success and result['throttled']
+
+    @patch('script.get_download_ydl')
+    def test_deferred_song_returns_after_fetch(self, mock_get, tmp_path, monkeypatch):
+        import pickle
+        monkeypatch.setattr(script, 'DOWNLOAD_FOLDER', str(tmp_path))
+        monkeypatch.setattr(script, 'download_manifest', {})
+        ydl = mock_get.return_value
+        ydl.params = {'outtmpl': {'default': ''}}
+        ydl.extract_info.return_value = {'requested_downloads': [
+            {'filepath': 'Title.webm', 'id': 'abc', '__postprocessors': [lambda: None]}]}
+        song = {'name': 'Song', 'artist': 'Artist', 'source': 'spotify', 'collection': 'Playlist'}
+        match = {'title': 'Song', 'url': 'https://www.youtube.com/watch?v=abc', 'id': 'abc'}
+        success, result, _ = script.process_song(song, download=True, index=1, total=1, youtube_match=match,
+                                                 searched=True, defer_transcode=True)
+        index, total, fetched = result['transcode']
+        assert success and not ydl.post_process.called
+        assert fetched['download']['filepath'] == 'Title.webm' and '__postprocessors' not in fetched['download']
+        pickle.dumps(result)  # crosses back from the download worker process
+
+    @patch('script.transcode_download')
+    def test_fetched_songs_finished_by_transcode_pool(self, mock_transcode):
+        mock_transcode.side_effect = lambda download, **_: download['filepath'].replace('.webm', '.opus') \
+            if download['id'] != 'bad' else None
+        script.metadata_cache_put(script.youtube_search_cache_key('bad', 'Artist'), {'id': 'bad'})
+        songs = [{'name': name, 'artist': 'Artist', 'source': 'spotify'} for name in ('a', 'bad', 'c', 'd')]
+
+        def completed():
+            for i, song in enumerate(songs, 1):
+                result = {'spotify': song, 'youtube': {'id': song['name']}}
+                if song['name'] == 'd':
+                    yield song, (True, result, 'already done')
+                    continue
+                result['transcode'] = (i, 4, {'download': {'id': song['name'], 'filepath': f"{song['name']}.webm"},
+                                              'cookiefile': None, 'metadata_args': []})
+                yield song, (True, result, '')
+
+        with script.ThreadPoolExecutor(max_workers=2) as transcoder:
+            finished = {song['name']: outcome for song, outcome in script.transcode_completed(completed(), transcoder, 2)}
+        assert finished['a'] == (True, {'spotify': songs[0], 'youtube': {'id': 'a', 'download_path': 'a.opus'}},
+                                 '[1/4] ✓ YouTube: a - Artist')
+        assert not finished['bad'][0] and 'Failed' in finished['bad'][2]
+        assert finished['d'][2] == 'already done' and len(finished) == 4
+        assert script.metadata_cache_get(script.youtube_search_cache_key('bad', 'Artist'), ttl=60) is None
+
+    def test_transcode_queue_bounds_waiting_downloads(self):
+        release, waiting, peak = threading.Event(), [0], [0]
+
+        def transcode(song, result):
+            release.wait(5)
+            return (True, result, '')
+
+        def completed():
+            for i in range(6):
+                peak[0] = max(peak[0], waiting[0])
+                waiting[0] += 1
+                yield {'name': i}, (True, {'transcode': ()}, '')
+
+        with script.ThreadPoolExecutor(max_workers=1) as transcoder, patch('script.finish_transcode', transcode):
+            threading.Timer(0.05, release.set).start()
+            for _ in script.transcode_completed(completed(), transcoder, 2):
+                waiting[0] -= 1
+        assert peak[0] <= 2
+
+    def test_adaptive_concurrency_grows_and_halves(self):
+        concurrency = script.AdaptiveConcurrency(2, 4, window=2)
+        for _ in range(6):
+            concurrency.record(False)
+        assert concurrency.limit == 4
+        concurrency.record(True)
+        assert concurrency.limit == 2
+
+    def test_run_adaptive_respects_limit(self):
+        in_flight, peak, lock = [0], [0], threading.Lock()
+
+        def job(i):
+            with lock:
+                in_flight[0] += 1
+                peak[0] = max(peak[0], in_flight[0])
+            time.sleep(0.01)
+            with lock:
+                in_flight[0] -= 1
+            return True, {'throttled': i == 0}, ''
+
+        concurrency = script.AdaptiveConcurrency(2, 8)
+        with script.ThreadPoolExecutor(max_workers=8) as executor:
+            finished = list(script.run_adaptive(executor, ((job, i) for i in range(20)), concurrency))
+        assert len(finished) == 20 and peak[0] <= 3
+
+
+class TestDownloadManifest:
+    @patch('script.search_youtube_for_song')
+    def test_skips_song_already_on_disk(self, mock_search, tmp_path, monkeypatch):
+        existing = tmp_path / 'song.opus'
+        existing.write_bytes(b'audio')
+        monkeypatch.setattr(script, 'download_manifest', {'Artist|Song': str(existing)})
+        song = {'name': 'Song', 'artist': 'Artist', 'source': 'spotify', 'collection': 'Playlist'}
+        success, result, message = script.process_song(song, download=True, index=1, total=1)
+        assert success and result['already_downloaded'] and not mock_search.called
+
+    @patch('script.search_youtube_for_song')
+    def test_redownloads_missing_file(self, mock_search, tmp_path, monkeypatch):
+        mock_search.return_value = {'title': 'Song', 'url': 'u', 'id': 'x', 'download_path': '/file.opus'}
+        monkeypatch.setattr(script, 'download_manifest', {'Artist|Song': str(tmp_path / 'gone.opus')})
+        song = {'name': 'Song', 'artist': 'Artist', 'source': 'spotify', 'collection': 'Playlist'}
+        success, _, _ = script.process_song(song, download=True, index=1, total=1)
+        assert success and mock_search.called
+
+    def test_load_and_save_roundtrip(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(script, 'DOWNLOAD_MANIFEST', str(tmp_path / 'downloaded.json'))
+        monkeypatch.setattr(script, 'RESULTS_JSONL', str(tmp_path / 'results.jsonl'))
+        monkeypatch.setattr(script, 'download_manifest', {})
+        assert script.load_download_manifest() == {}
+        script.download_manifest['Artist|Song'] = 'song.opus'
+        script.save_download_manifest()
+        script.download_manifest = {}
+        assert script.load_download_manifest() == {'Artist|Song': 'song.opus'}
+
+    def test_interleave_by_collection(self):
+        songs = [{'name': n, 'collection': c} for n, c in [('a1', 'A'), ('a2', 'A'), ('a3', 'A'), ('b1', 'B'), ('c1', 'C')]]
+        assert [s['name'] for s in script.interleave_by_collection(songs)] == ['a1', 'b1', 'c1', 'a2', 'a3']
+
+    def test_recovers_songs_from_interrupted_run(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(script, 'DOWNLOAD_MANIFEST', str(tmp_path / 'downloaded.json'))
+        monkeypatch.setattr(script, 'RESULTS_JSONL', str(tmp_path / 'results.jsonl'))
+        monkeypatch.setattr(script, 'download_manifest', {})
+        finished = {'spotify': {'name': 'Song', 'artist': 'Artist'}, 'youtube': {'download_path': 'song.opus'}}
+        failed = {'spotify': {'name': 'Other', 'artist': 'Artist'}, 'youtube': None}
+        (tmp_path / 'results.jsonl').write_bytes(script.dumps_json_line(finished) + script.dumps_json_line(failed) + b'{"spot')
+        assert script.load_download_manifest() == {'Artist|Song': 'song.opus'}
+
+    def test_recovered_songs_survive_results_truncation(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(script, 'DOWNLOAD_MANIFEST', str(tmp_path / 'downloaded.json'))
+        monkeypatch.setattr(script, 'RESULTS_JSONL', str(tmp_path / 'results.jsonl'))
+        monkeypatch.setattr(script, 'download_manifest', {})
+        finished = {'spotify': {'name': 'Song', 'artist': 'Artist'}, 'youtube': {'download_path': 'song.opus'}}
+        (tmp_path / 'results.jsonl').write_bytes(script.dumps_json_line(finished))
+        script.load_download_manifest()
+        open(script.RESULTS_JSONL, 'wb').close()  # what main does before the next run's results
+        script.download_manifest = {}
+        assert script.load_download_manifest() == {'Artist|Song': 'song.opus'}
+        assert json.loads((tmp_path / 'downloaded.json').read_text()) == {'Artist|Song': 'song.opus'}
+
+
+class TestSearchCache:
+    @patch('script.get_search_ydl')
+    @patch('script.search_ytmusic_candidates')
+    def test_repeat_search_served_from_cache(self, mock_ytm, mock_ydl):
+        mock_ytm.return_value = [script.youtube_candidate('abc', 'Song', 'Artist')]
+        assert script.search_youtube_for_song('Song', 'Artist')['id'] == 'abc'
+        assert script.search_youtube_for_song('song', 'artist')['id'] == 'abc'
+        assert mock_ytm.call_count == 1
+
+    @patch('script.search_ytdlp_candidates', return_value=[])
+    @patch('script.search_innertube_candidates', return_value=[])
+    @patch('script.search_ytmusic_candidates', return_value=[])
+    def test_miss_cached_with_shorter_ttl(self, mock_ytm, mock_innertube, mock_ytdlp, monkeypatch):
+        assert script.search_youtube_for_song('Song', 'Artist') is None
+        assert script.search_youtube_for_song('Song', 'Artist') is None
+        assert mock_ytm.call_count == 1
+        monkeypatch.setattr(script, 'SEARCH_MISS_CACHE_TTL', -1)
+        script.search_youtube_for_song('Song', 'Artist')
+        assert mock_ytm.call_count == 2
+
+    @patch('script.download_youtube_audio', return_value=None)
+    @patch('script.search_ytmusic_candidates')
+    def test_failed_download_invalidates_cache(self, mock_ytm, mock_download):
+        mock_ytm.return_value = [script.youtube_candidate('abc', 'Song', 'Artist')]
+        script.search_youtube_for_song('Song', 'Artist', download=True)
+        assert script.metadata_cache_get(script.youtube_search_cache_key('Song', 'Artist'), ttl=60) is None
+
+
 class TestSpotifyUrlParsing:
-    def test_playlist_url_standard(self):
-        playlist_id, url_type = script.parse_spotify_url("https://open.spotify.com/playlist/37i9dQZF1DXcBWIGoYBM5M")
-        assert playlist_id == "37i9dQZF1DXcBWIGoYBM5M" and url_type == "playlist"
-    
-    def test_playlist_url_with_params(self):
-        playlist_id, url_type = script.parse_spotify_url("https://open.spotify.com/playlist/37i9dQZF1DXcBWIGoYBM5M?si=abc123")
-        assert playlist_id == "37i9dQZF1DXcBWIGoYBM5M" and url_type == "playlist"
-    
-    def test_track_url(self):
-        track_id, url_type = script.parse_spotify_url("https://open.spotify.com/track/4iV5W9uYEdYUVa79Axb7Rh")
-        assert track_id == "4iV5W9uYEdYUVa79Axb7Rh" and url_type == "track"
-    
-    def test_spotify_uri_playlist(self):
-        playlist_id, url_type = script.parse_spotify_url("spotify:playlist:37i9dQZF1DXcBWIGoYBM5M")
-        assert playlist_id == "37i9dQZF1DXcBWIGoYBM5M" and url_type == "playlist"
-    
-    def test_spotify_uri_track(self):
-        track_id, url_type = script.parse_spotify_url("spotify:track:4iV5W9uYEdYUVa79Axb7Rh")
-        assert track_id == "4iV5W9uYEdYUVa79Axb7Rh" and url_type == "track"
-    
-    def test_invalid_url(self):
-        assert script.parse_spotify_url("https://example.com/not-spotify") == (None, None)
-    
-    def test_empty_string(self):
-        assert script.parse_spotify_url("") == (None, None)
+    @pytest.mark.parametrize("url,item_id,url_type", [
+        ("https://open.spotify.com/playlist/37i9dQZF1DXcBWIGoYBM5M", "37i9dQZF1DXcBWIGoYBM5M", "playlist"),
+        ("https://open.spotify.com/playlist/37i9dQZF1DXcBWIGoYBM5M?si=abc123", "37i9dQZF1DXcBWIGoYBM5M", "playlist"),
+        ("https://open.spotify.com/track/4iV5W9uYEdYUVa79Axb7Rh", "4iV5W9uYEdYUVa79Axb7Rh", "track"),
+        ("spotify:playlist:37i9dQZF1DXcBWIGoYBM5M", "37i9dQZF1DXcBWIGoYBM5M", "playlist"),
+        ("spotify:track:4iV5W9uYEdYUVa79Axb7Rh", "4iV5W9uYEdYUVa79Axb7Rh", "track"),
+        ("spotify:album:1DFixLWuPkv3KT3TnV35m3", "1DFixLWuPkv3KT3TnV35m3", "album"),
+        ("https://example.com/not-spotify", None, None),
+        ("", None, None),
+    ])
+    def test_parse(self, url, item_id, url_type):
+        assert script.parse_spotify_url(url) == (item_id, url_type)
 
 
 class TestYouTubeUrlParsing:
-    def test_youtube_music_playlist(self):
-        assert script.parse_youtube_url("https://music.youtube.com/playlist?list=PLrAXtmErZgOeiKm4sgNOknGvNjby9efdf") == "PLrAXtmErZgOeiKm4sgNOknGvNjby9efdf"
-    
-    def test_youtube_standard_playlist(self):
-        assert script.parse_youtube_url("https://www.youtube.com/playlist?list=PLrAXtmErZgOeiKm4sgNOknGvNjby9efdf") == "PLrAXtmErZgOeiKm4sgNOknGvNjby9efdf"
-    
-    def test_youtube_video_with_list(self):
-        assert script.parse_youtube_url("https://www.youtube.com/watch?v=dQw4w9WgXcQ&list=PLrAXtmErZgOeiKm4sgNOknGvNjby9efdf") == "PLrAXtmErZgOeiKm4sgNOknGvNjby9efdf"
-    
-    def test_liked_music_playlist(self):
-        assert script.parse_youtube_url("https://music.youtube.com/playlist?list=LM") == "LM"
-    
-    def test_invalid_url(self):
-        assert script.parse_youtube_url("https://example.com/not-youtube") is None
-    
-    def test_empty_string(self):
-        assert script.parse_youtube_url("") is None
+    @pytest.mark.parametrize("url,playlist_id", [
+        ("https://music.youtube.com/playlist?list=PLrAXtmErZgOeiKm4sgNOknGvNjby9efdf", "PLrAXtmErZgOeiKm4sgNOknGvNjby9efdf"),
+        ("https://www.youtube.com/playlist?list=PLrAXtmErZgOeiKm4sgNOknGvNjby9efdf", "PLrAXtmErZgOeiKm4sgNOknGvNjby9efdf"),
+        ("https://www.youtube.com/watch?v=dQw4w9WgXcQ&list=PLrAXtmErZgOeiKm4sgNOknGvNjby9efdf", "PLrAXtmErZgOeiKm4sgNOknGvNjby9efdf"),
+        ("https://www.youtube.com/watch?v=dQw4w9WgXcQ&index=3&list=PLabc_-1", "PLabc_-1"),
+        ("https://music.youtube.com/playlist?list=LM", "LM"),
+        ("https://example.com/not-youtube", None),
+        ("", None),
+    ])
+    def test_parse(self, url, playlist_id):
+        assert script.parse_youtube_url(url) == playlist_id
 
 
 class TestFilenameSanitization:
     @staticmethod
     def sanitize(artist, track):
-        return "".join(c for c in f"{artist} - {track}" if c.isalnum() or c in (' ', '-', '_')).strip()
+        return "".join([c for c in f"{artist} - {track}" if c.isalnum() or c in (' ', '-', '_')]).strip()
     
     def test_basic_filename(self):
         assert self.sanitize("Artist Name", "Track Name") == "Artist Name - Track Name"
@@ -72,13 +523,26 @@ class TestFilenameSanitization:
         safe = self.sanitize("Artist 🎵", "Song 💿")
         assert "🎵" not in safe and "💿" not in safe
 
+    def test_ascii_table_matches_isalnum_rule(self):
+        table = script.FilenameCharTable()
+        assert all(table[c] == (c if chr(c).isalnum() or chr(c) in ' -_' else None) for c in range(128))
+
+    def test_ascii_fast_path_matches_table(self):
+        text = ''.join(map(chr, range(128)))
+        assert script.sanitize_filename(text) == text.translate(script.FILENAME_CHAR_TABLE).strip()
+
+    def test_script_sanitizer_matches_reference(self):
+        for artist, track in [("Artist/Name:Test", "Track<>Name"), ("アーティスト", "トラック"),
+                              ("Artist 🎵", "Song 💿"), ("Beyoncé", "Déjà_Vu (feat. Jay-Z)"), ("  ", "..")]:
+            assert script.sanitize_filename(f"{artist} - {track}") == self.sanitize(artist, track)
+
 
 class TestEnvironmentVariables:
     def test_audio_format(self):
-        assert script.AUDIO_FORMAT in ['opus', 'm4a', 'mp3', 'flac', 'wav']
+        assert script.AUDIO_FORMAT in script.VALID_AUDIO_FORMATS
     
     def test_audio_quality(self):
-        assert script.AUDIO_QUALITY in ['best', '256', '192', '160', '128']
+        assert script.AUDIO_QUALITY in script.VALID_AUDIO_QUALITIES
     
     def test_download_folder(self):
         assert script.DOWNLOAD_FOLDER and len(script.DOWNLOAD_FOLDER) > 0
@@ -138,6 +602,56 @@ class TestProcessSong:
         success, _, message = script.process_song(song, download=False, index=1, total=1)
         assert not success and "Not found" in message
     
+    @patch('script.download_youtube_audio')
+    @patch('script.search_youtube_for_song')
+    def test_uses_prefetched_youtube_match(self, mock_search, mock_download):
+        mock_download.return_value = '/path/to/file.opus'
+        song = {'name': 'Song', 'artist': 'Artist', 'source': 'spotify', 'collection': 'Playlist'}
+        match = {'title': 'Song', 'url': 'https://www.youtube.com/watch?v=abc', 'id': 'abc'}
+        success, result, _ = script.process_song(song, download=True, index=1, total=1, youtube_match=match, searched=True)
+        assert success and result['youtube']['download_path'] == '/path/to/file.opus'
+        assert not mock_search.called and 'download_path' not in match
+
+    @patch('script.download_youtube_audio')
+    def test_uses_precomputed_subfolder(self, mock_download, monkeypatch):
+        monkeypatch.setattr(script, 'download_manifest', {})
+        mock_download.return_value = '/path/to/file.opus'
+        song = {'name': 'Song', 'artist': 'Artist', 'source': 'spotify', 'collection': 'My: Playlist'}
+        match = {'title': 'Song', 'url': 'https://www.youtube.com/watch?v=abc', 'id': 'abc'}
+        script.process_song(song, download=True, index=1, total=1, youtube_match=match, searched=True,
+                            subfolder='precomputed')
+        assert mock_download.call_args.args[3] == 'precomputed'
+
+    @patch('script.search_youtube_for_song')
+    def test_prefetched_miss_is_not_found(self, mock_search):
+        song = {'name': 'Song', 'artist': 'Artist', 'source': 'spotify', 'collection': 'Playlist'}
+        success, _, message = script.process_song(song, download=False, index=1, total=1, youtube_match=None, searched=True)
+        assert not success and 'Not found' in message and not mock_search.called
+
+    @patch('script.search_youtube_for_song')
+    def test_find_youtube_matches_keeps_order(self, mock_search):
+        mock_search.side_effect = lambda name, artist: {'id': name}
+        songs = [{'name': str(i), 'artist': 'Artist'} for i in range(20)]
+        assert [m['id'] for m in script.find_youtube_matches(songs)] == [str(i) for i in range(20)]
+
+    @patch('script.search_youtube_for_song')
+    def test_find_youtube_matches_searches_repeats_once(self, mock_search):
+        mock_search.side_effect = lambda name, artist: {'id': name}
+        songs = [{'name': 'Song', 'artist': 'Artist'}, {'name': 'Other', 'artist': 'Artist'},
+                 {'name': 'song', 'artist': 'ARTIST'}]
+        assert [m['id'] for m in script.find_youtube_matches(songs)] == ['Song', 'Other', 'Song']
+        assert mock_search.call_count == 2
+
+    @patch('script.find_youtube_matches')
+    def test_resolve_matches_partitions_by_source(self, mock_find, monkeypatch):
+        monkeypatch.setattr(script, 'zotify_available', False)
+        ytm = {'name': 'Song', 'artist': 'Artist', 'videoId': 'abc123', 'source': 'ytmusic'}
+        spotify = {'name': 'Other', 'artist': 'Artist', 'source': 'spotify'}
+        mock_find.return_value = [None]
+        matches = script.resolve_youtube_matches([ytm, spotify], download=False)
+        mock_find.assert_called_once_with([spotify])
+        assert matches[id(ytm)]['id'] == 'abc123' and matches[id(spotify)] is None
+
     @patch('script.download_youtube_audio')
     def test_ytmusic_song_with_video_id(self, mock_download):
         mock_download.return_value = '/path/to/file.opus'
@@ -149,22 +663,21 @@ class TestProcessSong:
 class TestInputValidation:
     @staticmethod
     def parse(choice):
-        return [int(x.strip())-1 for x in choice.split(',') if x.strip()]
-    
-    def test_comma_separated(self):
-        assert self.parse("1, 2, 3") == [0, 1, 2]
+        return script.parse_selection(choice)
     
-    def test_single_number(self):
-        assert self.parse("5") == [4]
+    @pytest.mark.parametrize("choice,indices", [
+        ("1, 2, 3", [0, 1, 2]),
+        ("5", [4]),
+        ("1,2,3,", [0, 1, 2]),
+        ("  1  ,  2  ,  3  ", [0, 1, 2]),
+        ("", []),
+    ])
+    def test_parse(self, choice, indices):
+        assert self.parse(choice) == indices
     
-    def test_trailing_comma(self):
-        assert self.parse("1,2,3,") == [0, 1, 2]
-    
-    def test_with_spaces(self):
-        assert self.parse("  1  ,  2  ,  3  ") == [0, 1, 2]
-    
-    def test_empty_input(self):
-        assert self.parse("") == []
+    def test_rejects_non_numbers(self):
+        with pytest.raises(ValueError):
+            self.parse("1, two")
     
     def test_bounds_checking(self):
         playlists = [{'id': '1'}, {'id': '2'}, {'id': '3'}]
@@ -176,13 +689,10 @@ class TestInputValidation:
 class TestDeduplication:
     @staticmethod
     def dedupe(songs):
-        seen, unique = set(), []
+        unique = {}
         for s in songs:
-            key = f"{s['name']}|{s['artist']}"
-            if key not in seen:
-                seen.add(key)
-                unique.append(s)
-        return unique
+            unique.setdefault((s['name'], s['artist']), s)
+        return list(unique.values())
     
     def test_removes_duplicates(self):
         songs = [{'name': 'A', 'artist': '1'}, {'name': 'B', 'artist': '2'}, {'name': 'A', 'artist': '1'}]
@@ -192,61 +702,349 @@ class TestDeduplication:
         songs = [{'name': 'A', 'artist': '1'}, {'name': 'A', 'artist': '2'}]
         assert len(self.dedupe(songs)) == 2
 
+    def test_keeps_first_occurrence_order(self):
+        songs = [{'name': 'B', 'artist': '2', 'id': 0}, {'name': 'A', 'artist': '1'}, {'name': 'B', 'artist': '2', 'id': 2}]
+        assert [s['name'] for s in self.dedupe(songs)] == ['B', 'A'] and self.dedupe(songs)[0]['id'] == 0
+
+
+class TestBackoff:
+    def test_retries_rate_limited_spotify_call(self, monkeypatch):
+        monkeypatch.setattr(script.time, 'sleep', lambda _: None)
+        func = MagicMock(side_effect=[script.SpotifyException(429, -1, 'rate limited'), {'items': []}])
+        assert script.spotify_call(func) == {'items': []}
+        assert func.call_count == 2
+
+    def test_does_not_retry_permission_error(self, monkeypatch):
+        monkeypatch.setattr(script.time, 'sleep', lambda _: None)
+        func = MagicMock(side_effect=script.SpotifyException(403, -1, 'forbidden'))
+        with pytest.raises(script.SpotifyException):
+            script.spotify_call(func)
+        assert func.call_count == 1
+
+    def test_gives_up_after_max_retries(self, monkeypatch):
+        monkeypatch.setattr(script.time, 'sleep', lambda _: None)
+        func = MagicMock(side_effect=script.DownloadError('HTTP Error 429: Too Many Requests'))
+        wrapped = script.with_backoff(max_retries=2)(func)
+        with pytest.raises(script.DownloadError):
+            wrapped()
+        assert func.call_count == 3
+
+    def test_honours_retry_after(self, monkeypatch):
+        sleeps = []
+        monkeypatch.setattr(script.time, 'sleep', sleeps.append)
+        error = script.SpotifyException(429, -1, 'rate limited', headers={'Retry-After': '7'})
+        func = MagicMock(side_effect=[error, {'items': []}])
+        assert script.spotify_call(func) == {'items': []}
+        assert sleeps == [7.0]
+
+    def test_slot_released_while_backing_off(self, monkeypatch):
+        slots = script.threading.BoundedSemaphore(1)
+        free_during_sleep = []
+        def sleep(_):
+            free_during_sleep.append(slots.acquire(blocking=False))
+            slots.release()
+        monkeypatch.setattr(script.time, 'sleep', sleep)
+        func = MagicMock(side_effect=[script.DownloadError('HTTP Error 503'), 'ok'])
+        assert script.with_backoff(slots=slots)(func)() == 'ok'
+        assert free_during_sleep == [True]
+
+    def test_token_bucket_waits_when_empty(self, monkeypatch):
+        sleeps = []
+        bucket = script.TokenBucket(rate=10, capacity=1)
+        bucket.acquire()
+        monkeypatch.setattr(script.time, 'sleep', lambda seconds: (sleeps.append(seconds), setattr(bucket, 'tokens', 1)))
+        bucket.acquire()
+        assert sleeps and 0 < sleeps[0] <= 0.1
+
+
+class TestJsonHelpers:
+    def test_write_json_file_keeps_unicode(self, tmp_path):
+        path = tmp_path / 'results.json'
+        script.write_json_file(str(path), [{'name': 'トラック'}])
+        assert 'トラック' in path.read_text(encoding='utf-8')
+
+    def test_write_json_file_without_orjson(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(script, 'orjson', None)
+        path = tmp_path / 'results.json'
+        script.write_json_file(str(path), [{'name': 'Song'}])
+        assert script.json.loads(path.read_text(encoding='utf-8')) == [{'name': 'Song'}]
+
+    @pytest.mark.parametrize('use_orjson', [True, False])
+    def test_jsonl_converts_to_indented_array(self, tmp_path, monkeypatch, use_orjson):
+        if not use_orjson:
+            monkeypatch.setattr(script, 'orjson', None)
+        records = [{'spotify': {'name': 'トラック'}, 'youtube': None}, {'spotify': {'name': 'B'}, 'youtube': {'id': 'x'}}]
+        jsonl_path, json_path = tmp_path / 'results.jsonl', tmp_path / 'results.json'
+        jsonl_path.write_bytes(b''.join(script.dumps_json_line(r) for r in records))
+        script.convert_jsonl_to_json(str(jsonl_path), str(json_path))
+        assert json_path.read_text(encoding='utf-8') == script.json.dumps(records, indent=2, ensure_ascii=False)
+
+    def test_empty_jsonl_converts_to_empty_array(self, tmp_path):
+        (tmp_path / 'results.jsonl').write_bytes(b'')
+        script.convert_jsonl_to_json(str(tmp_path / 'results.jsonl'), str(tmp_path / 'results.json'))
+        assert (tmp_path / 'results.json').read_text() == '[]'
+
+    @pytest.mark.skipif(script.orjson is None, reason='orjson not installed')
+    def test_spotify_client_decodes_with_orjson(self):
+        response = MagicMock(content=b'{"items": [1, 2]}')
+        script.decode_json_with_orjson(response)
+        assert response.json() == {'items': [1, 2]}
+
+
+class TestMetadataCache:
+    def test_roundtrip(self):
+        script.metadata_cache_put('key', [{'name': 'Song'}])
+        assert script.metadata_cache_get('key', ttl=60) == [{'name': 'Song'}]
+
+    def test_expired(self, monkeypatch):
+        script.metadata_cache_put('key', [1])
+        monkeypatch.setattr(script.time, 'time', lambda: 10 ** 12)
+        assert script.metadata_cache_get('key', ttl=60) is None
+
+    def test_snapshot_mismatch(self):
+        script.metadata_cache_put('key', [1], snapshot_id='abc')
+        assert script.metadata_cache_get('key', ttl=60, snapshot_id='abc') == [1]
+        assert script.metadata_cache_get('key', ttl=60, snapshot_id='def') is None
+
+    def test_disabled(self, monkeypatch):
+        monkeypatch.setattr(script, 'METADATA_CACHE_PATH', '')
+        script.metadata_cache_put('key', [1])
+        assert script.metadata_cache_get('key', ttl=60) is None
+
+    def test_connection_reused_within_thread_and_uses_wal(self):
+        conn = script.open_metadata_cache()
+        assert script.open_metadata_cache() is conn
+        assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+
+    def test_playlist_songs_reused_while_snapshot_unchanged(self, spotify_client):
+        spotify_client.playlist.return_value = {'snapshot_id': 'snap1', 'tracks': {'total': 1}}
+        track = {'track': {'name': 'Song', 'artists': [{'name': 'Artist'}], 'album': {'name': 'Album'}, 'uri': 'spotify:track:1'}}
+        spotify_client.playlist_tracks.return_value = {'items': [track], 'total': 1}
+        assert len(script.get_spotify_playlist_songs('p1', 'Playlist')) == 1
+        assert len(script.get_spotify_playlist_songs('p1', 'Playlist')) == 1
+        assert spotify_client.playlist_tracks.call_count == 1
+
+
+class TestSongDeduplication:
+    def test_case_and_whitespace_insensitive(self):
+        songs = [{'name': 'Song', 'artist': 'Artist'}, {'name': 'song ', 'artist': 'ARTIST'}]
+        assert script.dedupe_songs(songs) == [songs[0]]
+
+    def test_featured_artists_ignored(self):
+        songs = [{'name': 'Song (feat. Guest)', 'artist': 'Artist, Guest'}, {'name': 'Song', 'artist': 'Artist'}]
+        assert len(script.dedupe_songs(songs)) == 1
+
+    def test_unbracketed_credit_needs_credit_text(self):
+        assert script.normalize_song_text('Song feat. Guest') == 'song'
+        assert script.normalize_song_text('Little Feat') == 'little feat'
+        assert script.normalize_song_text('Daft Punk ft') == 'daft punk ft'
+
+    def test_accents_folded(self):
+        assert script.normalize_song_text('Café') == script.normalize_song_text('cafe')
+
+    def test_keeps_different_artists(self):
+        songs = [{'name': 'A', 'artist': '1'}, {'name': 'A', 'artist': '2'}]
+        assert len(script.dedupe_songs(songs)) == 2
+
+    def test_keeps_distinct_versions(self):
+        songs = [{'name': 'Song', 'artist': 'Artist'}, {'name': 'Song (Live)', 'artist': 'Artist'}]
+        assert len(script.dedupe_songs(songs)) == 2
+
+    def test_punctuation_only_title_not_collapsed(self):
+        songs = [{'name': '!!!', 'artist': 'Artist'}, {'name': '???', 'artist': 'Artist'}]
+        assert len(script.dedupe_songs(songs)) == 2
+
+
+class TestYTMusicCookie:
+    def test_cookie_read_once(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        (tmp_path / script.YTMUSIC_COOKIE_FILE).write_text('SID=abc; HSID=def')
+        monkeypatch.setattr(script, 'ytmusic_cookie', None)
+        assert script.get_ytmusic_cookie() == 'SID=abc; HSID=def'
+        (tmp_path / script.YTMUSIC_COOKIE_FILE).write_text('SID=changed')
+        assert script.get_ytmusic_cookie() == 'SID=abc; HSID=def'
+
+    def test_refresh_prompts_once(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        (tmp_path / script.YTMUSIC_COOKIE_FILE).write_text('SID=old')
+        monkeypatch.setattr(script, 'ytmusic_cookie', 'SID=old')
+        prompt = MagicMock(return_value='SID=new')
+        monkeypatch.setattr('builtins.input', prompt)
+        assert script.get_ytmusic_cookie(force_refresh=True) == 'SID=new'
+        assert prompt.call_count == 1
+
+    def test_cookie_replaced_by_another_thread_not_refreshed_again(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setattr(script, 'ytmusic_cookie', 'SID=old')
+        prompt = MagicMock(return_value='SID=new')
+        monkeypatch.setattr('builtins.input', prompt)
+        ydl_cookies = []
+
+        def extract_info(url, download):
+            if ydl_cookies[-1] == 'SID=old':
+                script.ytmusic_cookie = 'SID=pasted'  # another thread's refresh finished first
+                raise Exception('HTTP Error: status code: 401')
+            return {'id': url}
+
+        def get_ydl(cookie):
+            ydl_cookies.append(cookie)
+            return MagicMock(extract_info=extract_info)
+        monkeypatch.setattr(script, 'get_ytmusic_ydl', get_ydl)
+        assert script.extract_ytmusic_info('p1') == {'id': 'p1'}
+        assert ydl_cookies == ['SID=old', 'SID=pasted'] and not prompt.called
+
+    def test_cookie_header_parsed_once(self):
+        assert script.parse_ytmusic_cookie('SID=abc; HSID=def') is script.parse_ytmusic_cookie('SID=abc; HSID=def')
+
+    def test_cookie_loaded_into_jar_without_cookies_txt(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        ydl = script.YoutubeDL({'quiet': True})
+        script.load_ytmusic_cookie(ydl, 'SID=abc; HSID=def')
+        cookies = {c.name: c for c in ydl.cookiejar}
+        assert cookies['SID'].value == 'abc' and cookies['SID'].domain == '.youtube.com'
+        assert not (tmp_path / 'cookies.txt').exists()
+
 
 class TestPlaylistsFile:
-    def test_not_exists(self):
-        with patch('os.path.exists', return_value=False):
-            assert script.process_playlists_file() == []
+    def test_not_exists(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        assert script.process_playlists_file() == []
+
+    @patch('script.get_ytmusic_playlist_from_url')
+    @patch('script.get_spotify_playlist_from_url')
+    def test_urls_fetched_in_file_order(self, mock_spotify, mock_ytm, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        (tmp_path / 'playlists.txt').write_text('https://open.spotify.com/playlist/a\n# comment\n'
+                                                'https://music.youtube.com/playlist?list=b\nnot a url\n')
+        mock_spotify.return_value = ('A', [{'name': 'from spotify'}])
+        mock_ytm.return_value = ('B', [{'name': 'from youtube'}])
+        assert [s['name'] for s in script.process_playlists_file()] == ['from spotify', 'from youtube']
+
+    @patch('script.spotify_lookup_client')
+    @patch('script.get_spotify_playlist_from_url')
+    def test_track_urls_batched_in_file_order(self, mock_playlist, mock_client, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        urls = [f'spotify:track:t{i}' for i in range(30)] + ['https://open.spotify.com/playlist/p']
+        urls += [f'spotify:track:t{i}' for i in range(30, 60)]
+        (tmp_path / 'playlists.txt').write_text('\n'.join(urls) + '\n')
+        mock_playlist.return_value = ('P', [{'name': 'from playlist'}])
+        client = mock_client.return_value
+        client.tracks.side_effect = lambda ids: {'tracks': [
+            {'name': i, 'artists': [{'name': 'A'}], 'album': {'name': 'X'}, 'uri': f'spotify:track:{i}'}
+            for i in ids if i != 't5'] + [None]}
+        songs = script.process_playlists_file()
+        assert [len(c.args[0]) for c in client.tracks.call_args_list] == [50, 10]
+        expected = [f't{i}' for i in range(30) if i != 5] + ['from playlist'] + [f't{i}' for i in range(30, 60)]
+        assert [s['name'] for s in songs] == expected
 
 
 class TestSpotifyAPI:
-    @patch('script.sp')
-    @patch('script.init_spotify')
-    def test_get_playlists(self, mock_init, mock_sp):
-        mock_client = MagicMock()
-        mock_init.return_value = mock_client
-        mock_client.current_user_playlists.return_value = {
+    @patch('script.build_spotify_client')
+    @patch('script.SpotifyOAuth')
+    def test_concurrent_init_prompts_once(self, mock_oauth, mock_build, monkeypatch):
+        monkeypatch.setattr(script, 'sp', None)
+        monkeypatch.setattr(script, 'SPOTIFY_CLIENT_ID', 'id')
+        monkeypatch.setattr(script, 'SPOTIFY_CLIENT_SECRET', 'secret')
+        mock_oauth.return_value.get_cached_token.return_value = None
+
+        def prompt(_):
+            time.sleep(0.05)
+            return 'http://127.0.0.1:8888/callback?code=abc'
+        paste = MagicMock(side_effect=prompt)
+        monkeypatch.setattr('builtins.input', paste)
+        with script.ThreadPoolExecutor(max_workers=3) as executor:
+            clients = list(executor.map(lambda _: script.init_spotify(), range(3)))
+        assert clients == [mock_build.return_value] * 3 and paste.call_count == 1
+
+    def test_cached_playlist_songs_share_collection_string(self, spotify_client):
+        spotify_client.playlist.return_value = {'snapshot_id': 's1', 'tracks': {'total': 2}}
+        track = {'name': 'Song', 'artists': [{'name': 'Artist'}], 'album': {'name': 'Album'}, 'uri': 'spotify:track:1'}
+        spotify_client.playlist_tracks.return_value = {'items': [{'track': track}] * 2, 'total': 2}
+        script.fetch_spotify_playlist_songs(spotify_client, 'p1', 'My Playlist')
+        cached = script.fetch_spotify_playlist_songs(spotify_client, 'p1', 'My Playlist')
+        assert spotify_client.playlist_tracks.call_count == 1
+        assert cached[0]['collection'] is cached[1]['collection'] and cached[0]['source'] is cached[1]['source']
+
+    def test_get_playlists(self, spotify_client):
+        spotify_client.current_user_playlists.return_value = {
             'items': [{'id': 'p1', 'name': 'Playlist', 'tracks': {'total': 10}}]
         }
-        script.sp = mock_client
         playlists = script.get_spotify_playlists()
         assert len(playlists) == 1 and playlists[0]['tracks_total'] == 10
+
+    def test_iter_playlists_yields_first_page_before_the_rest(self):
+        client = MagicMock()
+        pages = {0: {'items': [{'id': 'p1', 'name': 'A', 'tracks': {'total': 1}}], 'total': 60},
+                 50: {'items': [{'id': 'p2', 'name': 'B', 'tracks': {'total': 2}}], 'total': 60}}
+        client.current_user_playlists.side_effect = lambda limit, offset: pages[offset]
+        playlists = script.iter_spotify_playlists(client)
+        assert next(playlists)['id'] == 'p1' and client.current_user_playlists.call_count == 1
+        assert [p['id'] for p in playlists] == ['p2']
     
-    @patch('script.sp')
-    @patch('script.init_spotify')
-    def test_get_liked_songs_empty(self, mock_init, mock_sp):
-        mock_client = MagicMock()
-        mock_init.return_value = mock_client
-        mock_client.current_user_saved_tracks.return_value = {'items': []}
-        script.sp = mock_client
+    def test_print_status_is_throttled(self, capsys):
+        for i in range(100):
+            script.print_status(f'{i}', interval=60)
+        assert capsys.readouterr().out.count('\r') <= 1
+
+    def test_get_liked_songs_empty(self, spotify_client):
+        spotify_client.current_user_saved_tracks.return_value = {'items': []}
         assert len(script.get_spotify_liked_songs()) == 0
 
-    @patch('script.sp')
-    @patch('script.init_spotify')
-    def test_get_playlist_songs_premium_required(self, mock_init, mock_sp):
-        mock_client = MagicMock()
-        mock_init.return_value = mock_client
-        mock_client.playlist_tracks.side_effect = script.spotipy.SpotifyException(
+    def test_get_playlist_songs_premium_required(self, spotify_client):
+        spotify_client.playlist_tracks.side_effect = script.spotipy.SpotifyException(
             403,
             -1,
             "Active premium subscription required for the owner of the app."
         )
-        script.sp = mock_client
         assert script.get_spotify_playlist_songs('p1', 'Restricted Playlist') == []
 
-    @patch('script.sp')
-    @patch('script.init_spotify')
-    def test_get_playlists_premium_required(self, mock_init, mock_sp):
-        mock_client = MagicMock()
-        mock_init.return_value = mock_client
-        mock_client.current_user_playlists.side_effect = script.spotipy.SpotifyException(
+    def test_get_playlists_premium_required(self, spotify_client):
+        spotify_client.current_user_playlists.side_effect = script.spotipy.SpotifyException(
             403,
             -1,
             "Active premium subscription required for the owner of the app."
         )
-        script.sp = mock_client
         assert script.get_spotify_playlists() == []
 
+    def test_fetch_spotify_pages_preserves_order(self):
+        def fetch_page(limit, offset):
+            return {'items': list(range(offset, min(offset + limit, 120))), 'total': 120}
+        assert script.fetch_spotify_pages(fetch_page, 50) == list(range(120))
+
+    def test_iter_spotify_pages_is_lazy(self):
+        fetch_page = MagicMock(side_effect=lambda limit, offset: {'items': [offset], 'total': 200})
+        pages = script.iter_spotify_pages(fetch_page, 50)
+        assert next(pages) == {'items': [0], 'total': 200}
+        assert fetch_page.call_count == 1
+        assert [p['items'][0] for p in pages] == [50, 100, 150]
+
+    def test_known_total_fetches_every_page_concurrently(self):
+        fetch_page = MagicMock(side_effect=lambda limit, offset: {'items': [offset]})
+        assert script.fetch_spotify_pages(fetch_page, 100, total=250) == [0, 100, 200]
+        assert sorted(call.kwargs['offset'] for call in fetch_page.call_args_list) == [0, 100, 200]
+
+    def test_get_liked_songs_multiple_pages(self, spotify_client):
+        track = {'track': {'name': 'Song', 'artists': [{'name': 'Artist'}], 'album': {'name': 'Album'}, 'uri': 'spotify:track:1'}}
+        spotify_client.current_user_saved_tracks.side_effect = lambda limit, offset, market=None: {'items': [track] * min(limit, 75 - offset), 'total': 75}
+        assert len(script.get_spotify_liked_songs()) == 75
+        assert spotify_client.current_user_saved_tracks.call_count == 2
+
+    def test_get_playlist_songs_requests_projected_fields(self, spotify_client):
+        spotify_client.playlist_tracks.return_value = {'items': [], 'total': 0}
+        assert script.get_spotify_playlist_songs('p1', 'Playlist') == []
+        assert spotify_client.playlist_tracks.call_args.kwargs['fields'] == script.SPOTIFY_PLAYLIST_TRACK_FIELDS
+
+    def test_liked_songs_request_omits_available_markets(self, spotify_client):
+        spotify_client.current_user_saved_tracks.return_value = {'items': [], 'total': 0}
+        assert script.get_spotify_liked_songs() == []
+        assert spotify_client.current_user_saved_tracks.call_args.kwargs['market'] == 'from_token'
+
+    @patch('script.get_spotify_playlist_songs')
+    def test_selected_playlists_fetched_together_in_order(self, mock_get):
+        mock_get.side_effect = lambda playlist_id, name: [{'name': playlist_id}]
+        playlists = [{'id': str(i), 'name': f'Playlist {i}'} for i in range(5)]
+        assert [s['name'] for s in script.get_spotify_playlists_songs(playlists)] == ['0', '1', '2', '3', '4']
+
     def test_init_spotify_public_requires_credentials(self, monkeypatch, capsys):
         monkeypatch.setattr(script, 'SPOTIFY_CLIENT_ID', '')
         monkeypatch.setattr(script, 'SPOTIFY_CLIENT_SECRET', '')
@@ -270,9 +1068,20 @@ class TestEndToEnd:
     def test_full_workflow(self, mock_search):
         mock_search.return_value = {'title': 'Song', 'url': 'https://youtube.com/watch?v=xyz', 'id': 'xyz', 'download_path': '/file.opus'}
         songs = [{'name': f'Song {i}', 'artist': f'Artist {i}', 'source': 'spotify', 'collection': 'Test'} for i in range(2)]
-        results = [script.process_song(s, download=True, index=i+1, total=2) for i, s in enumerate(songs)]
+        with script.ThreadPoolExecutor(max_workers=script.MAX_CONCURRENT_DOWNLOADS) as executor:
+            results = [r for _, r in script.process_songs_concurrent(executor, songs, download=True)]
         assert all(r[0] for r in results) and mock_search.call_count == 2
     
+    @patch('script.search_youtube_for_song')
+    def test_concurrent_results_match_their_songs(self, mock_search):
+        mock_search.side_effect = lambda name, artist, **kwargs: {'title': name, 'url': 'u', 'id': name}
+        songs = [{'name': f'Song {i}', 'artist': 'Artist', 'source': 'spotify', 'collection': f'C{i % 3}'}
+                 for i in range(30)]
+        with script.ThreadPoolExecutor(max_workers=8) as executor:
+            completed = list(script.process_songs_concurrent(executor, songs, download=False,
+                                                             concurrency=script.AdaptiveConcurrency(8, 8)))
+        assert len(completed) == 30 and all(result['youtube']['id'] == song['name'] for song, (_, result, _) in completed)
+    
     @patch('script.search_youtube_for_song')
     def test_partial_failures(self, mock_search):
         mock_search.side_effect = [{'title': 'Song', 'url': 'https://youtube.com/watch?v=abc', 'id': 'abc'}, None]